@@ -0,0 +1,11 @@
+"""
+This package contains a benchmark suite for the hot paths of the other packages.
+
+The benchmarks run against synthetic data generated by the fixtures module and are run from the
+repository root with:
+
+    python3 -m benchmarks [names...] [--repeat N] [--scale N] [--data-dir DIR] [--output results.jsonl]
+
+Results are printed as a table and, if an output file is given, appended to it as JSON lines with
+one record per benchmark, suitable for tracking regressions over time.
+"""
@@ -0,0 +1,44 @@
+"""
+Command line entry point for the benchmarks, run as "python3 -m benchmarks" from the repository root.
+"""
+
+
+import argparse
+import sys
+import tempfile
+
+from . import suite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python3 -m benchmarks', description='Run the EStraX benchmarks.')
+    parser.add_argument('names', nargs='*', help='Only run benchmarks whose names start with any of these.')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Timed repeats per benchmark.')
+    parser.add_argument('-s', '--scale', type=int, default=1, help='Scale factor for the size of the fixtures.')
+    parser.add_argument('-d', '--data-dir', help='Directory for (re)using generated fixtures. '
+                                                 'Defaults to a temporary directory.')
+    parser.add_argument('-o', '--output', help='Append results as JSON lines to this file.')
+    parser.add_argument('-l', '--list', action='store_true', help='List the available benchmarks and exit.')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, _ in suite.BENCHMARKS:
+            print(name)
+        return
+
+    output = open(args.output, 'a') if args.output else None
+    try:
+        if args.data_dir is not None:
+            fx = suite.Fixtures(args.data_dir, scale=args.scale)
+            suite.print_summary(suite.run(fx, repeat=args.repeat, selected=args.names, output=output))
+        else:
+            with tempfile.TemporaryDirectory(prefix='estrax-bench-') as directory:
+                fx = suite.Fixtures(directory, scale=args.scale)
+                suite.print_summary(suite.run(fx, repeat=args.repeat, selected=args.names, output=output))
+    finally:
+        if output is not None:
+            output.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
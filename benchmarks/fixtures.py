@@ -0,0 +1,209 @@
+"""
+This module generates synthetic input data for the benchmarks.
+
+The generated files mimic the layouts the rest of the code expects: ECMWF netCDF4 files with the
+variables and dimensions described in ecmwf.variables (stored as packed shorts, like the real
+downloads), NILU trajectory files readable by trajlib.nilu.NiluTrajectories and large namelists
+readable by pyesx.Namelist.
+
+All generators take a seed so that the same fixtures are produced on every run.
+"""
+
+
+import datetime
+import os
+import random
+
+import netCDF4
+import numpy
+
+from ecmwf import time as ecmwf_time
+from ecmwf import variables
+
+
+DEFAULT_LEVELS = (1000, 925, 850, 700, 500, 300, 200)
+
+PRESSURE_LEVEL_VARIABLES = (variables.U_VELOCITY, variables.V_VELOCITY, variables.W_VELOCITY,
+                            variables.RELATIVE_HUMIDITY)
+SINGLE_LEVEL_VARIABLES = (variables.U_VELOCITY_10M, variables.V_VELOCITY_10M, variables.SURFACE_TEMPERATURE,
+                          variables.SURFACE_PRESSURE, variables.BOUNDARY_LAYER_HEIGHT)
+
+# Rough (offset, amplitude) of the synthetic fields, keyed on variable name.
+_FIELD_SCALES = {
+    'u': (5, 20), 'v': (0, 15), 'w': (0, 0.5), 'r': (50, 50),
+    'u10': (3, 10), 'v10': (0, 8), 't2m': (280, 20), 'sp': (100000, 3000), 'blh': (800, 700),
+    'lsp': (0.001, 0.001), 'tp': (0.002, 0.002),
+}
+
+
+def _synthetic_field(name, shape, rng):
+    offset, amplitude = _FIELD_SCALES.get(name, (0, 1))
+    # A smooth large scale pattern plus some noise, so that interpolation has something to chew on.
+    grids = numpy.meshgrid(*(numpy.linspace(0, 2 * numpy.pi, size) for size in shape), indexing='ij')
+    pattern = sum(numpy.sin(grid * (idx + 1)) for idx, grid in enumerate(grids)) / len(shape)
+    noise = rng.standard_normal(shape) * 0.1
+    return offset + amplitude * (pattern + noise)
+
+
+def _add_packed_variable(dataset, name, dimensions, data, contiguous=False):
+    # Pack into shorts the same way ECMWF does, using scale_factor and add_offset.
+    data_min, data_max = float(data.min()), float(data.max())
+    scale_factor = (data_max - data_min) / (2 ** 16 - 4) or 1.0  # Keep clear of the fill value.
+    add_offset = (data_max + data_min) / 2
+    var = dataset.createVariable(name, 'i2', dimensions, fill_value=-32767, contiguous=contiguous)
+    var.scale_factor = scale_factor
+    var.add_offset = add_offset
+    var[:] = data
+
+
+def write_ecmwf_file(path, start, time_steps=4, step_hours=6, levels=DEFAULT_LEVELS,
+                     lat_range=(30, 80), lon_range=(0, 359), resolution=1.0,
+                     pressure_level_variables=PRESSURE_LEVEL_VARIABLES,
+                     single_level_variables=SINGLE_LEVEL_VARIABLES, seed=0, file_format='NETCDF4',
+                     contiguous=False):
+    """
+    Write a single synthetic ECMWF netCDF file, by default in the netCDF4 format with chunked variables.
+
+    :param path: The path of the file to write.
+    :param start: A datetime object for the first time step.
+    :param time_steps: The number of time steps in the file.
+    :param step_hours: Hours between time steps.
+    :param levels: A sequence of pressure levels in hPa.
+    :param lat_range: The (min, max) latitudes covered.
+    :param lon_range: The (min, max) longitudes covered, in the -180 to 360 range. Defaults to the full circle.
+    :param resolution: The grid resolution in degrees.
+    :param pressure_level_variables: Variable descriptions (as in ecmwf.variables) on pressure levels.
+    :param single_level_variables: Variable descriptions (as in ecmwf.variables) without levels.
+    :param seed: Random seed.
+    :param file_format: The netCDF format of the file, e.g. NETCDF3_CLASSIC.
+    :param contiguous: Store the variables of a netCDF4 file contiguously instead of chunked. The
+    time dimension is then not unlimited.
+    """
+    rng = numpy.random.RandomState(seed)
+    first_hour = int(ecmwf_time.datetime_to_ecmwf_hours(start))
+    times = numpy.arange(time_steps) * step_hours + first_hour
+    # ECMWF files list latitudes from north to south.
+    lats = numpy.arange(lat_range[1], lat_range[0] - resolution / 2, -resolution)
+    lons = numpy.arange(lon_range[0], lon_range[1] + resolution / 2, resolution) % 360
+    with netCDF4.Dataset(path, 'w', format=file_format) as ds:
+        ds.createDimension('longitude', len(lons))
+        ds.createDimension('latitude', len(lats))
+        if len(pressure_level_variables) > 0:
+            ds.createDimension('level', len(levels))
+        ds.createDimension('time', len(times) if contiguous else None)
+        lon_var = ds.createVariable('longitude', 'f4', ('longitude',))
+        lon_var.units = 'degrees_east'
+        lon_var.long_name = 'longitude'
+        lon_var[:] = lons
+        lat_var = ds.createVariable('latitude', 'f4', ('latitude',))
+        lat_var.units = 'degrees_north'
+        lat_var.long_name = 'latitude'
+        lat_var[:] = lats
+        if len(pressure_level_variables) > 0:
+            level_var = ds.createVariable('level', 'i4', ('level',))
+            level_var.units = 'millibars'
+            level_var.long_name = 'pressure_level'
+            level_var[:] = levels
+        time_var = ds.createVariable('time', 'i4', ('time',))
+        time_var.units = 'hours since 1900-01-01 00:00:0.0'
+        time_var.long_name = 'time'
+        time_var.calendar = 'gregorian'
+        time_var[:] = times
+        for name, dimensions in pressure_level_variables:
+            shape = (len(times), len(levels), len(lats), len(lons))
+            _add_packed_variable(ds, name, dimensions, _synthetic_field(name, shape, rng), contiguous)
+        for name, dimensions in single_level_variables:
+            shape = (len(times), len(lats), len(lons))
+            _add_packed_variable(ds, name, dimensions, _synthetic_field(name, shape, rng), contiguous)
+
+
+def write_ecmwf_directory(directory, file_count=4, start=datetime.datetime(2015, 1, 1),
+                          time_steps=4, step_hours=6, seed=0, **kwargs):
+    """
+    Write a sequence of synthetic ECMWF files covering consecutive time ranges.
+
+    Extra keyword arguments are passed on to write_ecmwf_file.
+
+    :return: A list of the paths written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for idx in range(file_count):
+        file_start = start + datetime.timedelta(hours=idx * time_steps * step_hours)
+        path = os.path.join(directory, 'ecmwf_%s.nc' % file_start.strftime('%Y%m%d%H'))
+        write_ecmwf_file(path, file_start, time_steps=time_steps, step_hours=step_hours,
+                         seed=seed + idx, **kwargs)
+        paths.append(path)
+    return paths
+
+
+NILU_COLUMNS = ('HOUR', 'LAT', 'LON', 'Z', 'PRESS', 'TEMP')
+
+
+def write_nilu_file(path, trajectory_count=100, point_count=73, start=datetime.datetime(2015, 1, 1),
+                    heights=(500, 1000, 1500), seed=0):
+    """
+    Write a synthetic NILU trajectory file with random-walk back trajectories.
+
+    :param path: The path of the file to write.
+    :param trajectory_count: The number of trajectories.
+    :param point_count: The number of points per trajectory.
+    :param start: The arrival time of the first trajectory; later ones arrive 6 hours apart.
+    :param heights: Arrival heights, cycled through for consecutive trajectories.
+    :param seed: Random seed.
+    """
+    rng = random.Random(seed)
+    header = ['Synthetic NILU trajectory file', 'Generated for benchmarking', 'Columns: ' + ' '.join(NILU_COLUMNS)]
+    column_header = ''.join('%10s' % name for name in NILU_COLUMNS)
+    with open(path, 'w', encoding='latin-1') as file:
+        file.write('%d lines of header\n' % (len(header) + 1))
+        for line in header:
+            file.write(line + '\n')
+        for idx in range(trajectory_count):
+            arrival = start + datetime.timedelta(hours=6 * (idx // len(heights)))
+            date = arrival.strftime('%Y%m%d')
+            time = str(arrival.hour * 100 * 100)
+            file.write('Trajectory %s at %s stop index %d number of points: %d\n'
+                       % (date, time, point_count - 1, point_count))
+            file.write(column_header + '\n')
+            lat, lon, z = 60.0, 10.0, float(heights[idx % len(heights)])
+            for step in range(point_count):
+                pressure = 1013.25 * (1 - 2.25577e-5 * z) ** 5.25588
+                temperature = 288.15 - 0.0065 * z
+                values = (-step, lat, lon, z, pressure, temperature)
+                file.write(''.join('%10.3f' % value for value in values) + '\n')
+                lat = min(89.0, max(-89.0, lat + rng.gauss(0, 0.3)))
+                lon = (lon - abs(rng.gauss(0.5, 0.3)) + 180) % 360 - 180
+                z = max(0.0, z + rng.gauss(0, 50))
+
+
+def write_namelist(path, section_count=10, variables_per_section=200, table_rows=20, seed=0):
+    """
+    Write a large synthetic Fortran namelist in the format used by ESX configuration files.
+
+    :param path: The path of the file to write.
+    :param section_count: The number of sections.
+    :param variables_per_section: The number of variables per section.
+    :param table_rows: The number of rows of multi line (table) values, used for every tenth variable.
+    :param seed: Random seed.
+    """
+    rng = random.Random(seed)
+    with open(path, 'w') as file:
+        for section_idx in range(section_count):
+            file.write('&section_%d ! Synthetic section\n' % section_idx)
+            for var_idx in range(variables_per_section):
+                name = 'esx%%var_%d_%d' % (section_idx, var_idx)
+                kind = var_idx % 10
+                if kind == 0:
+                    file.write('%s =\n' % name)
+                    for row in range(table_rows):
+                        file.write("  'SPEC%d', %d, %.4f, T\n" % (row, row, rng.random()))
+                elif kind < 4:
+                    file.write('%s = %.6f\n' % (name, rng.uniform(-1e3, 1e3)))
+                elif kind < 7:
+                    file.write('%s = %d ! integer\n' % (name, rng.randint(0, 10000)))
+                elif kind < 9:
+                    file.write('%s = "%s"\n' % (name, 'value_%d' % rng.randint(0, 10000)))
+                else:
+                    file.write('%s = %s\n' % (name, rng.choice('TF')))
+            file.write('/\n')
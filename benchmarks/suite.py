@@ -0,0 +1,598 @@
+"""
+This module contains the benchmark cases and the machinery for timing them.
+
+Benchmarks are registered with the benchmark decorator. Each benchmark is a function taking a
+Fixtures object and returning a tuple (func, number, params), where func is a callable taking no
+arguments that is timed number times in a row per repeat, and params is a dict describing the workload
+which is included in the results.
+"""
+
+
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import fixtures
+
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    Decorator registering a benchmark function under the given name.
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+
+# Keyword arguments of fixtures.write_ecmwf_file for the storage layouts of ECMWF files.
+ECMWF_LAYOUTS = {
+    'chunked': {},
+    'contiguous': {'contiguous': True},
+    'netcdf3': {'file_format': 'NETCDF3_CLASSIC'},
+}
+
+
+class Fixtures:
+    """
+    Lazily generates the synthetic input data used by the benchmarks into a directory.
+    """
+
+    def __init__(self, directory, scale=1):
+        self.directory = directory
+        self.scale = scale
+        self._ecmwf_directory = None
+        self._nilu_path = None
+        self._namelist_path = None
+
+    @property
+    def ecmwf_directory(self):
+        if self._ecmwf_directory is None:
+            path = os.path.join(self.directory, 'ecmwf')
+            if not os.path.isdir(path):
+                fixtures.write_ecmwf_directory(path, file_count=4 * self.scale)
+            self._ecmwf_directory = path
+        return self._ecmwf_directory
+
+    def ecmwf_layout_directory(self, layout):
+        """
+        Return a directory of ECMWF files in the given storage layout, one of ECMWF_LAYOUTS. The
+        chunked layout is that of ecmwf_directory.
+        """
+        if layout == 'chunked':
+            return self.ecmwf_directory
+        path = os.path.join(self.directory, 'ecmwf-' + layout)
+        if not os.path.isdir(path):
+            fixtures.write_ecmwf_directory(path, file_count=self.scale, **ECMWF_LAYOUTS[layout])
+        return path
+
+    @property
+    def nilu_path(self):
+        if self._nilu_path is None:
+            path = os.path.join(self.directory, 'trajectories.nilu')
+            if not os.path.isfile(path):
+                fixtures.write_nilu_file(path, trajectory_count=100 * self.scale)
+            self._nilu_path = path
+        return self._nilu_path
+
+    @property
+    def namelist_path(self):
+        if self._namelist_path is None:
+            path = os.path.join(self.directory, 'config.nml')
+            if not os.path.isfile(path):
+                fixtures.write_namelist(path, section_count=10 * self.scale)
+            self._namelist_path = path
+        return self._namelist_path
+
+    def inventory(self):
+        import ecmwf.inventory
+        inventory = ecmwf.inventory.Inventory()
+        inventory.add_directory(self.ecmwf_directory)
+        return inventory
+
+
+def random_points(variable, count, seed=0):
+    """
+    Return count random points inside the coverage of the given variable.
+    """
+    rng = random.Random(seed)
+    # Pick points inside single datasets, since there may be gaps between the ranges of the files.
+    all_ranges = [variable.dataset_ranges[path] for path in sorted(variable.dataset_ranges)]
+    return [tuple(rng.uniform(low, high) for low, high in rng.choice(all_ranges)) for _ in range(count)]
+
+
+def wind_function(inventory):
+    """
+    Return a uvw function for trajlib backed by the u, v and w variables of the inventory.
+
+    Points are (latitude, longitude, pressure in hPa, seconds since the ECMWF epoch).
+    """
+    from ecmwf import variables
+    u = inventory.construct_variable(*variables.U_VELOCITY)
+    v = inventory.construct_variable(*variables.V_VELOCITY)
+    w = inventory.construct_variable(*variables.W_VELOCITY)
+
+    def uvw(point):
+        item = (point[3] / 3600, point[2], point[0], point[1])
+        return u[item], v[item], w[item] / 100  # Pa/s to hPa/s.
+
+    return uvw, u
+
+
+@benchmark('inventory.add_directory')
+def bench_add_directory(fx):
+    directory = fx.ecmwf_directory
+
+    def run():
+        import ecmwf.inventory
+        ecmwf.inventory.Inventory().add_directory(directory)
+
+    return run, 1, {'files': len(os.listdir(directory))}
+
+
+@benchmark('inventory.construct_variable')
+def bench_construct_variable(fx):
+    from ecmwf import variables
+    inventory = fx.inventory()
+
+    def run():
+        inventory.construct_variable(*variables.U_VELOCITY)
+
+    return run, 1, {'files': len(inventory.catalogue)}
+
+
+@benchmark('inventory.refresh')
+def bench_refresh(fx):
+    from ecmwf import variables
+    inventory = fx.inventory()
+    inventory.construct_variable(*variables.U_VELOCITY)
+
+    def run():
+        inventory.refresh()
+
+    return run, 1, {'files': len(inventory.catalogue)}
+
+
+@benchmark('variable.getitem')
+def bench_variable_getitem(fx):
+    from ecmwf import variables
+    inventory = fx.inventory()
+    u = inventory.construct_variable(*variables.U_VELOCITY)
+    points = random_points(u, 500)
+
+    def run():
+        with inventory:
+            for point in points:
+                u[point]
+
+    return run, 1, {'lookups': len(points), 'variable': u.name}
+
+
+def _get_values_benchmark(layout):
+    def bench(fx):
+        import ecmwf.inventory
+        import ecmwf.metrics
+        from ecmwf import variables
+        metrics = ecmwf.metrics.Metrics()
+        inventory = ecmwf.inventory.Inventory(metrics=metrics)
+        inventory.add_directory(fx.ecmwf_layout_directory(layout))
+        u = inventory.construct_variable(*variables.U_VELOCITY)
+        points = random_points(u, 500)
+        # Check that the planned lookups give the same values as single lookups.
+        with inventory:
+            expected = [u[point] for point in points]
+            metrics.reset()
+            values = u.get_values(points)
+        if values != expected:
+            raise RuntimeError('get_values differs from single lookups on the %s layout.' % layout)
+        bytes_read = metrics.summary()['counters'].get('bytes read')
+
+        def run():
+            with inventory:
+                u.get_values(points)
+
+        return run, 1, {'lookups': len(points), 'variable': u.name, 'layout': layout, 'bytes read': bytes_read}
+    return bench
+
+
+benchmark('variable.get_values')(_get_values_benchmark('chunked'))
+for _layout in ('contiguous', 'netcdf3'):
+    benchmark('variable.get_values.' + _layout)(_get_values_benchmark(_layout))
+
+
+@benchmark('variable.getitem.archive')
+def bench_variable_getitem_archive(fx):
+    import ecmwf.archive
+    import ecmwf.inventory
+    from ecmwf import variables
+    path = os.path.join(fx.directory, 'archive')
+    if not ecmwf.archive.is_archive(path):
+        ecmwf.archive.convert(fx.inventory(), [variables.U_VELOCITY], path)
+    inventory = ecmwf.inventory.Inventory()
+    inventory.add_directory(path)
+    u = inventory.construct_variable(*variables.U_VELOCITY)
+    points = random_points(fx.inventory().construct_variable(*variables.U_VELOCITY), 500)
+
+    def run():
+        with inventory:
+            for point in points:
+                u[point]
+
+    return run, 1, {'lookups': len(points), 'variable': u.name}
+
+
+def _preload_benchmark(storage):
+    def bench(fx):
+        from ecmwf import variables
+        inventory = fx.inventory()
+        u = inventory.construct_variable(*variables.U_VELOCITY, storage=storage)
+        points = random_points(u, 500)
+        with inventory:
+            preloaded_bytes = u.preload()
+
+        def run():
+            for point in points:
+                u[point]
+
+        return run, 1, {'lookups': len(points), 'variable': u.name, 'preloaded bytes': preloaded_bytes}
+    return bench
+
+
+for _storage in ('float64', 'float32', 'packed'):
+    benchmark('variable.getitem.preload.' + _storage)(_preload_benchmark(_storage))
+
+
+@benchmark('variable.getitem.threads')
+def bench_variable_getitem_threads(fx):
+    import concurrent.futures
+    import ecmwf.inventory
+    from ecmwf import variables
+    inventory = ecmwf.inventory.Inventory(concurrent=True)
+    inventory.add_directory(fx.ecmwf_directory)
+    u = inventory.construct_variable(*variables.U_VELOCITY)
+    points = random_points(u, 500)
+    workers = 4
+
+    def run():
+        with inventory:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(u.__getitem__, points, chunksize=25):
+                    pass
+
+    return run, 1, {'lookups': len(points), 'variable': u.name, 'threads': workers,
+                    'serialize io': inventory.io_lock is not None}
+
+
+@benchmark('cross_section.vertical')
+def bench_cross_section_vertical(fx):
+    import trajlib.cross_section
+    from ecmwf import variables
+    inventory = fx.inventory()
+    u = inventory.construct_variable(*variables.U_VELOCITY)
+    time_range = u.dataset_ranges[sorted(u.dataset_ranges)[0]][0]
+    time = (time_range[0] + time_range[1]) / 2
+
+    def run():
+        with inventory:
+            trajlib.cross_section.vertical_section(u, (45.0, 350.0), (70.0, 20.0), 200, time)
+
+    return run, 1, {'points': 200, 'variable': u.name}
+
+
+def _integrate_benchmark(method_name, prefetch=False, kernel_name='move'):
+    def bench(fx):
+        import trajlib
+        from ecmwf import time as ecmwf_time
+        inventory = fx.inventory()
+        uvw, u = wind_function(inventory)
+        # Integrate backwards through the time range of a single file.
+        (t_min, t_max), _, (lat_min, lat_max), _ = u.dataset_ranges[min(u.dataset_ranges)]
+        start = (float(lat_min + lat_max) / 2, 10.0, 850.0, float(t_max) * 3600)
+        dt = -600.0
+        duration = float(t_max - t_min) * 3600 * 0.9
+        method = functools.partial(getattr(trajlib.methods, method_name),
+                                   kernel=getattr(trajlib.methods, kernel_name))
+
+        def run():
+            with inventory:
+                if prefetch:
+                    inventory.enable_prefetch(dt / 3600)
+                for _ in trajlib.integrate(start, uvw, dt, duration, method=method):
+                    pass
+            inventory.disable_prefetch()
+
+        steps = int(duration // abs(dt))
+        return run, 1, {'method': method_name, 'kernel': kernel_name, 'steps': steps, 'dt': dt,
+                        'prefetch': prefetch, 'start': str(ecmwf_time.ecmwf_hours_to_datetime(t_max))}
+    return bench
+
+
+for _method_name in ('move_euler', 'move_trapezoid', 'move_rk4'):
+    benchmark('trajlib.integrate.' + _method_name)(_integrate_benchmark(_method_name))
+benchmark('trajlib.integrate.move_rk4.prefetch')(_integrate_benchmark('move_rk4', prefetch=True))
+benchmark('trajlib.integrate.move_rk4.prefetch.spherical')(
+    _integrate_benchmark('move_rk4', prefetch=True, kernel_name='move_spherical'))
+
+
+@contextlib.contextmanager
+def _fixture_winds(directory):
+    # A uvw factory for trajlib.distributed, at module level so that it can be given to worker processes.
+    import ecmwf.inventory
+    inventory = ecmwf.inventory.Inventory()
+    inventory.add_directory(directory)
+    uvw, _ = wind_function(inventory)
+    with inventory:
+        yield uvw
+
+
+def _check_queue(queue, shards, exit_codes):
+    # Checks the outcome of the distributed benchmark, where the last shard fails.
+    expected = {'pending': 0, 'claimed': 0, 'done': len(shards) - 1, 'failed': 1}
+    problems = []
+    if any(exit_codes):
+        problems.append('worker exit codes %s' % exit_codes)
+    if queue.status() != expected:
+        problems.append('status %s, expected %s' % (queue.status(), expected))
+    if sorted(queue.errors()) != shards[-1:]:
+        problems.append('errors for %s, expected %s' % (sorted(queue.errors()), shards[-1:]))
+    if queue.results() != [queue.result_path(shard) for shard in shards[:-1]] or \
+            not all(os.path.isfile(path) for path in queue.results()):
+        problems.append('results %s' % queue.results())
+    if queue.requeue_failed() != shards[-1:] or queue.errors() or queue.status()['pending'] != 1:
+        problems.append('requeueing the failed shard')
+    if problems:
+        raise RuntimeError('Unexpected work queue state: ' + '; '.join(problems))
+
+
+@benchmark('distributed.run_local')
+def bench_distributed_run_local(fx):
+    import trajlib.distributed
+    from ecmwf import variables
+    u = fx.inventory().construct_variable(*variables.U_VELOCITY)
+    (_, t_max), _, (lat_min, lat_max), _ = u.dataset_ranges[min(u.dataset_ranges)]
+    rng = random.Random(0)
+    lat_center = float(lat_min + lat_max) / 2
+    start_points = [(lat_center + rng.uniform(-5, 5), rng.uniform(5, 15), 850.0, float(t_max) * 3600)
+                    for _ in range(16)]
+    # The last start point is outside the time range of the data, so its shard fails.
+    start_points[-1] = start_points[-1][:3] + (float(t_max + 10 ** 6) * 3600,)
+    dt, duration, workers = -600.0, 3 * 3600.0, 4
+    uvw_factory = functools.partial(_fixture_winds, fx.ecmwf_directory)
+
+    def run():
+        directory = tempfile.mkdtemp(prefix='queue-', dir=fx.directory)
+        try:
+            queue = trajlib.distributed.WorkQueue(directory)
+            shards = queue.add_shards(start_points, shard_size=4)
+            # Simulate a worker which died while holding a claim, which the workers requeue as stale.
+            claim = queue.claim('dead-worker')
+            stale_time = time.time() - 3600
+            os.utime(claim.path, (stale_time, stale_time))
+            exit_codes = trajlib.distributed.run_local(queue, workers, uvw_factory, dt, duration,
+                                                       stale_timeout=600)
+            _check_queue(queue, shards, exit_codes)
+        finally:
+            shutil.rmtree(directory)
+
+    return run, 1, {'trajectories': len(start_points), 'shard size': 4, 'workers': workers,
+                    'steps': int(duration // abs(dt))}
+
+
+def _time_conversion_benchmark(vectorized):
+    def bench(fx):
+        import numpy
+        from ecmwf import time as ecmwf_time
+        count = 100000
+        hours = numpy.arange(count) * 0.25 + 1000000
+        if vectorized:
+            def run():
+                ecmwf_time.datetimes_to_ecmwf_hours(ecmwf_time.ecmwf_hours_to_datetimes(hours))
+        else:
+            def run():
+                for value in hours:
+                    ecmwf_time.datetime_to_ecmwf_hours(ecmwf_time.ecmwf_hours_to_datetime(value))
+        return run, 1, {'count': count}
+    return bench
+
+
+benchmark('time.roundtrip.scalar')(_time_conversion_benchmark(False))
+benchmark('time.roundtrip.vectorized')(_time_conversion_benchmark(True))
+
+
+def _random_moves(count, seed=0):
+    import numpy
+    rng = numpy.random.RandomState(seed)
+    lats, lons = rng.uniform(-89, 89, count), rng.uniform(0, 360, count)
+    u, v, w = rng.uniform(-40, 40, count), rng.uniform(-40, 40, count), rng.uniform(-1, 1, count)
+    return lats, lons, numpy.zeros(count), numpy.zeros(count), u, v, w
+
+
+def _kernel_error(kernel, dt=3600.0):
+    # The largest distance in meters between the result of the kernel and the exact ellipsoid kernel.
+    from trajlib import methods
+    lats, lons, zs, ts, u, v, w = _random_moves(10000, seed=1)
+    exact = [methods.move(p, uvw, dt) for p, uvw in zip(zip(lats, lons, zs, ts), zip(u, v, w))]
+    approx = [kernel(p, uvw, dt) for p, uvw in zip(zip(lats, lons, zs, ts), zip(u, v, w))]
+    _, _, errors = methods.GEOD.inv([p[1] for p in exact], [p[0] for p in exact],
+                                    [p[1] for p in approx], [p[0] for p in approx])
+    return max(errors)
+
+
+def _kernel_benchmark(kernel_name):
+    def bench(fx):
+        from trajlib import methods
+        kernel = getattr(methods, kernel_name)
+        lats, lons, zs, ts, u, v, w = _random_moves(10000)
+        points = list(zip(lats.tolist(), lons.tolist(), zs.tolist(), ts.tolist()))
+        uvws = list(zip(u.tolist(), v.tolist(), w.tolist()))
+
+        def run():
+            for point, uvw in zip(points, uvws):
+                kernel(point, uvw, 3600.0)
+
+        return run, 1, {'kernel': kernel_name, 'moves': len(points), 'max error m': _kernel_error(kernel)}
+    return bench
+
+
+def _array_kernel_benchmark(kernel_name):
+    def bench(fx):
+        from trajlib import methods
+        kernel = getattr(methods, kernel_name)
+        arrays = _random_moves(100000)
+
+        def run():
+            kernel(*arrays, dt=3600.0)
+
+        return run, 1, {'kernel': kernel_name, 'moves': len(arrays[0])}
+    return bench
+
+
+for _kernel_name in ('move', 'move_spherical'):
+    benchmark('methods.' + _kernel_name)(_kernel_benchmark(_kernel_name))
+for _kernel_name in ('move_arrays', 'move_spherical_arrays'):
+    benchmark('methods.' + _kernel_name)(_array_kernel_benchmark(_kernel_name))
+
+
+@benchmark('nilu.load')
+def bench_nilu_load(fx):
+    from trajlib import nilu
+    path = fx.nilu_path
+
+    def run():
+        nilu.NiluTrajectories(path)
+
+    return run, 1, {'trajectories': len(nilu.NiluTrajectories(path).trajectories)}
+
+
+@benchmark('clustering.kmeans')
+def bench_clustering_kmeans(fx):
+    from trajlib import clustering, nilu
+    trajectories = clustering.from_nilu(nilu.NiluTrajectories(fx.nilu_path).trajectories)
+    steps, k = 25, 6
+
+    def run():
+        clustering.kmeans(clustering.resample(trajectories, steps), k)
+
+    return run, 1, {'trajectories': len(trajectories), 'steps': steps, 'clusters': k}
+
+
+@benchmark('namelist.roundtrip')
+def bench_namelist_roundtrip(fx):
+    import pyesx
+    path = fx.namelist_path
+
+    def run():
+        namelist = pyesx.Namelist(path)
+        buffer = io.StringIO()
+        namelist.write(buffer)
+        buffer.seek(0)
+        pyesx.Namelist(file=buffer)
+
+    namelist = pyesx.Namelist(path)
+    return run, 1, {'sections': len(namelist.sections),
+                    'variables': sum(len(section) for section in namelist.sections.values())}
+
+
+HEAVY_MODULES = ('numpy', 'pyproj', 'netCDF4', 'matplotlib.pyplot', 'scipy')
+
+
+def _import_benchmark(module):
+    def bench(fx):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        statement = 'import ' + module if module else 'pass'
+        command = [sys.executable, '-c', statement]
+
+        def run():
+            subprocess.check_call(command, cwd=root)
+
+        # Also record which of the heavy dependencies importing the module pulls in.
+        probe = statement + '; import sys; print(" ".join(m for m in %r if m in sys.modules))' % (HEAVY_MODULES,)
+        loaded = subprocess.check_output([sys.executable, '-c', probe], cwd=root).decode().split()
+        return run, 1, {'module': module, 'heavy modules loaded': loaded}
+    return bench
+
+
+for _module in ('', 'numpy', 'pyproj', 'netCDF4', 'matplotlib.pyplot', 'pyesx', 'ecmwf', 'trajlib', 'plotting'):
+    benchmark('import.' + (_module or 'python'))(_import_benchmark(_module))
+
+
+def measure(func, repeat, number):
+    """
+    Time func, returning a list with the average time per call for each repeat.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+
+def environment():
+    """
+    Return a dict describing the environment the benchmarks run in.
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'commit': commit, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+def run(fx, repeat=5, selected=None, output=None):
+    """
+    Run the registered benchmarks, yielding one result dict per benchmark.
+
+    :param fx: A Fixtures object.
+    :param repeat: The number of timed repeats per benchmark.
+    :param selected: An optional sequence of name prefixes; only matching benchmarks are run.
+    :param output: An optional file object to which results are written as JSON lines.
+    """
+    env = environment()
+    for name, bench in BENCHMARKS:
+        if selected and not any(name.startswith(prefix) for prefix in selected):
+            continue
+        func, number, params = bench(fx)
+        func()  # Warm up, e.g. for file system caches.
+        times = measure(func, repeat, number)
+        result = {
+            'name': name,
+            'params': params,
+            'repeat': repeat,
+            'number': number,
+            'unit': 's',
+            'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+            'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+            'times': times,
+            'env': env,
+        }
+        if output is not None:
+            print(json.dumps(result, sort_keys=True), file=output)
+            output.flush()
+        yield result
+
+
+def print_summary(results, file=sys.stdout):
+    """
+    Print a human readable table of benchmark results.
+    """
+    for result in results:
+        print('%-48s %12.6f s (median of %d)' % (result['name'], result['median'], result['repeat']), file=file)
@@ -1,7 +1,15 @@
 """
 This package contains helper classes and functions for accessing ECMWF netCDF4 data.
+
+The netCDF4 and numpy modules are slow to import, so the modules of this package import them when
+first needed.
 """
 
+from . import archive
 from . import inventory
+from . import metrics
+from . import planner
+from . import prefetch
+from . import storage
 from . import time
 from . import variables
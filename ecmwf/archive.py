@@ -0,0 +1,262 @@
+"""
+This module provides conversion of ECMWF data to an archive layout optimized for the random access
+of trajectory sampling, and a reader for such archives which plugs into the Inventory and
+Variable classes.
+
+ECMWF netCDF downloads come in whatever layout and compression the provider chose, typically
+packed shorts which are compressed in large chunks. An archive instead stores every time step of
+every variable as an uncompressed numpy .npy file, in a directory holding a JSON manifest
+(manifest.json) with the axes, attributes and time steps of the variables. The time steps are
+memory-mapped when read, so a lookup only touches the pages holding its values and the operating
+system caches the pages shared by nearby lookups.
+
+An archive directory may be given to Inventory.add_file, and Inventory.add_directory adds any
+archives found instead of descending into them. Reads then go through ArchiveDataset, which mimics
+the parts of netCDF4.Dataset used by the Inventory and Variable classes.
+
+Example:
+
+    inventory = ecmwf.inventory.Inventory()
+    inventory.add_directory('./Data')
+    ecmwf.archive.convert(inventory, [ecmwf.variables.U_VELOCITY, ecmwf.variables.V_VELOCITY],
+                          './Archive')
+    archive_inventory = ecmwf.inventory.Inventory()
+    archive_inventory.add_file('./Archive')
+    u_wind = archive_inventory.construct_variable(*ecmwf.variables.U_VELOCITY)
+
+"""
+
+
+import json
+import os
+
+
+MANIFEST_NAME = 'manifest.json'
+FORMAT_VERSION = 1
+
+# Attributes describing the packing of the source data, which do not apply to the unpacked archive.
+_PACKING_ATTRIBUTES = ('scale_factor', 'add_offset', '_FillValue', 'missing_value')
+
+
+def is_archive(path):
+    """
+    Return true if the given path is an archive directory.
+    """
+    return os.path.isfile(os.path.join(path, MANIFEST_NAME))
+
+
+def _attributes(nc_var):
+    attributes = {}
+    for name in nc_var.ncattrs():
+        if name not in _PACKING_ATTRIBUTES:
+            value = nc_var.getncattr(name)
+            attributes[name] = value.tolist() if hasattr(value, 'tolist') else value
+    return attributes
+
+
+def convert(inventory, variable_descriptions, directory, dtype='f4'):
+    """
+    Convert variables of an inventory to an archive. All variables must be on the same grid and, if
+    they have a time axis, cover the same time steps and have time as their first axis. The time
+    steps of all files are merged into one time axis, so lookups in gaps between the files are
+    interpolated across the gap. Time steps present in several files are taken from the first file.
+
+    The manifest is written last, so an interrupted conversion does not leave a usable archive.
+
+    :param inventory: The Inventory holding the files to convert. Must not be used as a context
+    manager by the caller during the conversion.
+    :param variable_descriptions: A sequence of (name, type) tuples, e.g. from ecmwf.variables.
+    :param directory: The directory of the archive. Created if needed.
+    :param dtype: The numpy data type the values are stored as. Missing values are stored as NaN.
+    :return: The manifest of the archive as a dict.
+    """
+    import numpy
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'format': FORMAT_VERSION, 'axes': {}, 'variables': {}}
+    axes = manifest['axes']
+    times = None
+    for name, type_ in variable_descriptions:
+        type_ = tuple(type_)
+        if 'time' in type_ and type_[0] != 'time':
+            raise ValueError('The time axis of variable ' + name + ' must be its first axis.')
+        variable = inventory.construct_variable(name, type_)
+        if not variable.dataset_ranges:
+            raise ValueError('No files with variable ' + name + ' of type ' + str(type_) + '.')
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+        steps = {}
+        with inventory:
+            for path in sorted(variable.dataset_ranges, key=lambda path: variable.dataset_ranges[path][0]):
+                dataset = inventory.open_dataset(path)
+                nc_var = dataset.variables[name]
+                for axis in type_:
+                    if axis == 'time':
+                        continue
+                    values = dataset.variables[axis][:].tolist()
+                    if axis not in axes:
+                        axes[axis] = {'values': values, 'dtype': dataset.variables[axis].dtype.str,
+                                      'attributes': _attributes(dataset.variables[axis])}
+                    elif axes[axis]['values'] != values:
+                        raise ValueError('The ' + axis + ' axis of ' + path + ' differs from the archive.')
+                if name not in manifest['variables']:
+                    manifest['variables'][name] = {'type': list(type_), 'dtype': numpy.dtype(dtype).str,
+                                                   'attributes': _attributes(nc_var)}
+                if 'time' not in type_:
+                    if not steps:
+                        steps[None] = name + '/' + name + '.npy'
+                        _save(os.path.join(directory, steps[None]), nc_var[:], dtype)
+                    continue
+                time_var = dataset.variables['time']
+                axes.setdefault('time', {'values': [], 'dtype': time_var.dtype.str,
+                                         'attributes': _attributes(time_var)})
+                for time_index, time_value in enumerate(time_var[:].tolist()):
+                    if time_value not in steps:
+                        steps[time_value] = '%s/%s.npy' % (name, time_value)
+                        _save(os.path.join(directory, steps[time_value]), nc_var[time_index], dtype)
+        entry = manifest['variables'][name]
+        if None in steps:
+            entry['file'] = steps[None]
+        else:
+            variable_times = sorted(steps)
+            if times is not None and times != variable_times:
+                raise ValueError('Variable ' + name + ' does not cover the same times as the other variables.')
+            times = variable_times
+            entry['files'] = [steps[time_value] for time_value in variable_times]
+    if times is not None:
+        axes['time']['values'] = times
+    temporary_path = os.path.join(directory, MANIFEST_NAME + '.tmp')
+    with open(temporary_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(temporary_path, os.path.join(directory, MANIFEST_NAME))
+    return manifest
+
+
+def _save(path, values, dtype):
+    import numpy
+    values = numpy.ma.filled(numpy.ma.asarray(values, dtype=numpy.float64), numpy.nan)
+    numpy.save(path, values.astype(dtype))
+
+
+class _ArchiveVariable:
+    """
+    Base class of the variables of an ArchiveDataset, mimicking a netCDF4.Variable.
+    """
+
+    def __init__(self, name, dimensions, shape, dtype, attributes):
+        import numpy
+        self.name = name
+        self.dimensions = tuple(dimensions)
+        self.shape = tuple(shape)
+        self.ndim = len(self.shape)
+        self.dtype = numpy.dtype(dtype)
+        self.attributes = attributes
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['attributes'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def ncattrs(self):
+        return list(self.attributes)
+
+    def getncattr(self, name):
+        return self.attributes[name]
+
+    def chunking(self):
+        # The time steps are uncompressed memory maps, so there are no chunks worth reading whole.
+        return 'contiguous'
+
+    @staticmethod
+    def _result(value):
+        # Values are returned in double precision like netCDF4 does for unpacked data, so that
+        # interpolation is done in double precision also from blocks read by ecmwf.planner.
+        import numpy
+        return numpy.float64(value) if numpy.ndim(value) == 0 else numpy.asarray(value, dtype=numpy.float64)
+
+
+class ArchiveAxis(_ArchiveVariable):
+
+    def __init__(self, name, values, attributes):
+        super().__init__(name, (name,), values.shape, values.dtype, attributes)
+        self.values = values
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+
+class ArchiveVariable(_ArchiveVariable):
+    """
+    A variable of an archive, reading its time steps through memory maps.
+    """
+
+    def __init__(self, directory, name, entry, axes):
+        shape = tuple(len(axes[axis]) for axis in entry['type'])
+        super().__init__(name, entry['type'], shape, entry['dtype'], entry['attributes'])
+        self.directory = directory
+        self.files = entry.get('files')
+        self.file = entry.get('file')
+        self.steps = {}
+
+    def _step(self, time_index):
+        step = self.steps.get(time_index)
+        if step is None:
+            import numpy
+            step = numpy.load(os.path.join(self.directory, self.files[time_index]), mmap_mode='r')
+            self.steps[time_index] = step
+        return step
+
+    def __getitem__(self, index):
+        import numpy
+        if not isinstance(index, tuple):
+            index = (index,)
+        if self.files is None:
+            return self._result(self._step_all()[index])
+        time_index, rest = index[0], index[1:]
+        if isinstance(time_index, slice):
+            return self._result(numpy.stack([self._step(idx)[rest]
+                                             for idx in range(*time_index.indices(self.shape[0]))]))
+        if not isinstance(time_index, int) and numpy.ndim(time_index) > 0:
+            return self._result(numpy.stack([self._step(int(idx))[rest] for idx in time_index]))
+        return self._result(self._step(int(time_index) % self.shape[0])[rest])
+
+    def _step_all(self):
+        step = self.steps.get(None)
+        if step is None:
+            import numpy
+            step = numpy.load(os.path.join(self.directory, self.file), mmap_mode='r')
+            self.steps[None] = step
+        return step
+
+
+class ArchiveDataset:
+    """
+    Reads an archive directory, mimicking the parts of a netCDF4.Dataset used by the ecmwf package.
+    """
+
+    def __init__(self, path):
+        import numpy
+        with open(os.path.join(path, MANIFEST_NAME), 'r') as file:
+            manifest = json.load(file)
+        if manifest.get('format') != FORMAT_VERSION:
+            raise RuntimeError('Unsupported archive format in ' + path + '.')
+        self.path = path
+        self.manifest = manifest
+        self.variables = {}
+        axis_values = {}
+        for name, entry in manifest['axes'].items():
+            values = numpy.array(entry['values'], dtype=entry['dtype'])
+            axis_values[name] = values
+            self.variables[name] = ArchiveAxis(name, values, entry['attributes'])
+        for name, entry in manifest['variables'].items():
+            self.variables[name] = ArchiveVariable(path, name, entry, axis_values)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        for variable in self.variables.values():
+            if isinstance(variable, ArchiveVariable):
+                variable.steps = {}
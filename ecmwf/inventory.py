@@ -3,26 +3,66 @@ This module provides two classes to help with accessing ECMWF netCDF4 files.
 """
 
 
+import collections
 import contextlib
 import itertools
+import math
 import os
+import threading
+import time
+import weakref
 
-import netCDF4
+from . import archive, interpolation, planner, prefetch, storage as ecmwf_storage, time as ecmwf_time, variables
 
-from . import interpolation, variables
+
+# Serializes calls into the netCDF library from concurrent inventories. Common netCDF and HDF5
+# builds are not thread safe, even when each thread uses its own dataset handles.
+NETCDF_LOCK = threading.RLock()
+
+
+def open_file(path):
+    """
+    Open a netCDF file, or an archive directory (see ecmwf.archive), for reading.
+    """
+    if archive.is_archive(path):
+        return archive.ArchiveDataset(path)
+    import netCDF4
+    return netCDF4.Dataset(path)
 
 
 class Inventory:
     """
     This class keeps an inventory of known ECMWF files and their variables.
 
-    The methods add_directory and add_file can be used to add ECMWF files to the inventory.
+    The methods add_directory and add_file can be used to add ECMWF files to the inventory. Archive
+    directories converted with ecmwf.archive may be added like files.
 
     The construct_variable method can be used to access a variable.
 
     To read data from the variables it is required that the Inventory object is
     used as a context manager using the with statement.
 
+    An ecmwf.metrics.Metrics object may be given to record instrumentation of the data access.
+
+    Files arriving in, changing in or disappearing from the directories added to the inventory can
+    be picked up with the refresh method, which also updates the variables already constructed.
+
+    By default every dataset read from is kept open until the context exits. If max_open_datasets
+    is given, at most that many datasets are kept open and the least recently used dataset is
+    closed when another one needs opening. Closed datasets are transparently reopened when used
+    again. The attributes datasets_opened and datasets_closed count the churn.
+
+    If concurrent is true the inventory may safely be shared by several threads, e.g. of a
+    concurrent.futures.ThreadPoolExecutor. By default this does not make lookups scale with the
+    number of threads: lookups from several threads are somewhat slower than the same lookups
+    from one thread. For throughput, batch lookups with Variable.get_values instead. Each thread
+    opens its own dataset handles (the open_datasets attribute and max_open_datasets apply per
+    thread) and variables keep their last used dataset per thread. Threads must be done reading
+    before the context exits. Since common builds of the netCDF and HDF5 libraries are not thread
+    safe, every call into them is by default serialized through NETCDF_LOCK, so reads never
+    overlap, and the remaining work of a lookup holds the GIL. Only with libraries built thread
+    safe may serialize_io be set to false, so that reads proceed in parallel.
+
     Example:
 
         inventory = ecmwf.inventory.Inventory()
@@ -34,37 +74,98 @@ class Inventory:
 
     """
 
-    def __init__(self):
+    def __init__(self, metrics=None, max_open_datasets=None, concurrent=False, serialize_io=True):
+        if max_open_datasets is not None and max_open_datasets < 1:
+            raise ValueError('At least one dataset must be allowed to be open.')
         self.catalogue = {}
+        self.time_axes = {}
+        self.directories = []  # (path, recursive) of the directories added, rescanned by refresh.
+        self.file_stats = {}  # Path -> (modification time, size) when added to the catalogue.
         self.exit_stack = None
-        self.open_datasets = None
+        self.max_open_datasets = max_open_datasets
+        self.datasets_opened = 0
+        self.datasets_closed = 0
+        self.metrics = metrics
+        self.prefetcher = None
+        self.concurrent = concurrent
+        self.io_lock = NETCDF_LOCK if concurrent and serialize_io else None
+        self._open_datasets = None
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+        self._thread_pools = []
+        self._generation = 0
+        self._variables = weakref.WeakSet()
 
     def __enter__(self):
         if self.exit_stack is not None:
             raise RuntimeError("Recursive use of Inventory as context manager.")
         self.exit_stack = contextlib.ExitStack()
-        self.open_datasets = {}
+        self._open_datasets = collections.OrderedDict()
+        self._generation += 1
+        self.exit_stack.callback(self._close_datasets)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.prefetcher is not None:
+            self.prefetcher.clear()
         self.exit_stack.close()
         self.exit_stack = None
-        self.open_datasets = None
+        self._open_datasets = None
+
+    @property
+    def open_datasets(self):
+        """
+        The datasets currently open (for the calling thread in concurrent mode), keyed on path.
+        None when the inventory is not used as a context manager.
+        """
+        if not self.concurrent or self._open_datasets is None:
+            return self._open_datasets
+        local = self._thread_local
+        if getattr(local, 'generation', None) != self._generation:
+            # First use by this thread within the current context.
+            local.generation = self._generation
+            local.open_datasets = collections.OrderedDict()
+            with self._lock:
+                self._thread_pools.append(local.open_datasets)
+        return local.open_datasets
 
     def add_directory(self, path, recursive=True):
         abs_norm_path = os.path.normpath(os.path.abspath(path))
-        for name in os.listdir(abs_norm_path):
-            full_name = os.path.join(abs_norm_path, name)
-            if os.path.isfile(full_name):
-                self.add_file(full_name)
+        if (abs_norm_path, recursive) not in self.directories:
+            self.directories.append((abs_norm_path, recursive))
+        for file_path in self._scan_directory(abs_norm_path, recursive):
+            self.add_file(file_path)
+
+    @staticmethod
+    def _scan_directory(path, recursive):
+        # Yields the paths of the files and archives in a directory.
+        if archive.is_archive(path):
+            yield path
+            return
+        for name in os.listdir(path):
+            full_name = os.path.join(path, name)
+            if os.path.isfile(full_name) or archive.is_archive(full_name):
+                yield full_name
             elif recursive and os.path.isdir(full_name):
-                self.add_directory(full_name)
+                yield from Inventory._scan_directory(full_name, recursive)
+
+    @staticmethod
+    def _file_stat(path):
+        # Returns (modification time, size) of a file or archive, or None if it does not exist.
+        if os.path.isdir(path):
+            path = os.path.join(path, archive.MANIFEST_NAME)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
 
     def add_file(self, path):
         abs_norm_path = os.path.normpath(os.path.abspath(path))
         if abs_norm_path in self.catalogue:
             return
+        self.file_stats[abs_norm_path] = self._file_stat(abs_norm_path)
         try:
-            with netCDF4.Dataset(path) as ds:
+            with self.io_guard(), open_file(abs_norm_path) as ds:
                 catalogue_entry = {'vars': {}, 'time range': None}
                 for var_name, var_desc in ds.variables.items():
                     var_type = var_desc.dimensions
@@ -75,16 +176,73 @@ class Inventory:
                             min_time, max_time = int(var_desc[0]), int(var_desc[-1])
                             catalogue_entry['time range'] = (min_time, max_time)
                     catalogue_entry['vars'][var_name] = var_type
-                self.catalogue[path] = catalogue_entry
-        except RuntimeError:
+                self.catalogue[abs_norm_path] = catalogue_entry
+        except (RuntimeError, OSError):  # Not a netCDF file. Newer netCDF4 versions raise OSError.
             self.catalogue[abs_norm_path] = None
             return
 
+    def refresh(self):
+        """
+        Update the inventory with the files added to, changed in and removed from its directories
+        since they were scanned. Unchanged files are not read again. Files added with add_file are
+        checked for changes and removal as well.
+
+        The catalogue and the variables constructed by construct_variable are updated in place.
+        Open datasets and cached data of changed and removed files are dropped. Must not be called
+        while other threads read from the inventory.
+
+        :return: A dict with lists of the paths added, changed and removed.
+        """
+        found = set()
+        for directory, recursive in self.directories:
+            if os.path.isdir(directory):
+                found.update(self._scan_directory(directory, recursive))
+        added = sorted(path for path in found if path not in self.catalogue)
+        changed, removed = [], []
+        for path in list(self.catalogue):
+            stat = self._file_stat(path)
+            if stat is None:
+                removed.append(path)
+            elif stat != self.file_stats.get(path):
+                changed.append(path)
+        for path in changed + removed:
+            self._forget_file(path)
+        for path in added + changed:
+            self.add_file(path)
+            entry = self.catalogue[path]
+            if entry is None:
+                continue
+            for variable in list(self._variables):
+                if entry['vars'].get(variable.name) == variable.type:
+                    variable.add_file(path)
+        return {'added': added, 'changed': changed, 'removed': removed}
+
+    def _forget_file(self, path):
+        # Removes a file from the catalogue and the variables, closing it and dropping cached data.
+        if self.prefetcher is not None:
+            with self.prefetcher.lock:
+                self.prefetcher.drop_dataset(path)
+                self._close_dataset_everywhere(path)
+        else:
+            self._close_dataset_everywhere(path)
+        for variable in list(self._variables):
+            variable.remove_file(path)
+        self.catalogue.pop(path, None)
+        self.time_axes.pop(path, None)
+        self.file_stats.pop(path, None)
+
+    def _close_dataset_everywhere(self, path):
+        # Closes the handles of the dataset of all threads.
+        if self._open_datasets is not None:
+            pools = list(self._thread_pools) if self.concurrent else [self._open_datasets]
+            for open_datasets in pools:
+                self._close_dataset(path, open_datasets)
+
     def get_files_with_variable(self, var_name, var_type):
         if not isinstance(var_type, tuple):
             var_type = tuple(var_type)
         for path, entry in self.catalogue.items():
-            if var_name in entry['vars'] and entry['vars'][var_name] == var_type:
+            if entry is not None and var_name in entry['vars'] and entry['vars'][var_name] == var_type:
                 yield path
 
     def enumerate_paths(self):
@@ -94,20 +252,148 @@ class Inventory:
         vars_generator = (entry['vars'].items() for entry in self.catalogue.values())
         yield from set(itertools.chain(*vars_generator))
 
-    def construct_variable(self, var_name, var_type):
-        var = Variable(var_name, var_type, inventory=self)
+    def construct_variable(self, var_name, var_type, storage='float64', out_of_coverage='raise'):
+        """
+        Construct a Variable reading the given variable from the files of the inventory.
+        :param storage: The storage mode of data kept in memory, see ecmwf.storage.
+        :param out_of_coverage: What lookups outside the coverage do, see Variable.
+        """
+        var = Variable(var_name, var_type, inventory=self, storage=storage, out_of_coverage=out_of_coverage)
         for path in self.get_files_with_variable(var_name, var_type):
             var.add_file(path)
+        self._variables.add(var)
         return var
 
+    def enable_prefetch(self, dt, max_slabs=4):
+        """
+        Enable loading of upcoming time slabs on a background thread. See the ecmwf.prefetch module.
+        :param dt: The time step of the integration in the unit of the time axis, e.g. negative for
+        back trajectories.
+        :param max_slabs: The maximum number of time slabs kept in memory per variable.
+        :return: The Prefetcher object.
+        """
+        if self.concurrent:
+            raise RuntimeError('Prefetching is not supported for concurrent inventories.')
+        self.disable_prefetch()
+        self.prefetcher = prefetch.Prefetcher(self, dt, max_slabs=max_slabs)
+        return self.prefetcher
+
+    def disable_prefetch(self):
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+            self.prefetcher = None
+
+    def get_time_axis(self, path):
+        """
+        Return the time axis of the given file decoded to numpy datetime64 values, in file order.
+        Decoded axes are cached per file.
+        """
+        time_axis = self.time_axes.get(path)
+        if time_axis is None:
+            with self.io_guard(), open_file(path) as ds:
+                hours = ds.variables['time'][:]
+            with self._lock:
+                time_axis = self.time_axes.setdefault(path, ecmwf_time.ecmwf_hours_to_datetimes(hours))
+        return time_axis
+
+    def io_guard(self):
+        """
+        Return a context manager serializing netCDF access of the calling thread with the loads of
+        the prefetcher, if enabled, and with other threads in concurrent mode. Reads which do not
+        go through Variable.__getitem__ should open datasets and read within it.
+        """
+        if self.prefetcher is None:
+            return self.io_lock if self.io_lock is not None else contextlib.nullcontext()
+        if self.io_lock is None:
+            return self.prefetcher.lock
+        guard = contextlib.ExitStack()
+        guard.enter_context(self.prefetcher.lock)
+        guard.enter_context(self.io_lock)
+        return guard
+
     def open_dataset(self, path):
-        assert self.exit_stack is not None and self.open_datasets is not None
-        if path in self.open_datasets:
-            return self.open_datasets[path]
-        ds = self.exit_stack.enter_context(netCDF4.Dataset(path))
-        self.open_datasets[path] = ds
+        open_datasets = self.open_datasets
+        assert self.exit_stack is not None and open_datasets is not None
+        ds = open_datasets.get(path)
+        if ds is not None:
+            if self.max_open_datasets is not None:
+                open_datasets.move_to_end(path)
+            return ds
+        if self.max_open_datasets is not None:
+            while len(open_datasets) >= self.max_open_datasets:
+                self._close_dataset(next(iter(open_datasets)), open_datasets)
+        if self.io_lock is not None:
+            with self.io_lock:
+                ds = open_file(path)
+        else:
+            ds = open_file(path)
+        open_datasets[path] = ds
+        with self._lock:
+            self.datasets_opened += 1
+        if self.metrics is not None:
+            self.metrics.count_dataset(path, 'datasets opened')
         return ds
 
+    def close_dataset(self, path):
+        """
+        Close a dataset opened by open_dataset, releasing its resources. It is reopened if used again.
+        In concurrent mode only the handle of the calling thread is closed.
+        """
+        if self.prefetcher is not None:
+            with self.prefetcher.lock:
+                self.prefetcher.drop_dataset(path)
+                self._close_dataset(path)
+        else:
+            self._close_dataset(path)
+
+    def _close_dataset(self, path, open_datasets=None):
+        if open_datasets is None:
+            open_datasets = self.open_datasets
+        ds = open_datasets.pop(path, None)
+        if ds is not None:
+            if self.io_lock is not None:
+                with self.io_lock:
+                    ds.close()
+            else:
+                ds.close()
+            with self._lock:
+                self.datasets_closed += 1
+            if self.metrics is not None:
+                self.metrics.count_dataset(path, 'datasets closed')
+
+    def _close_datasets(self):
+        if self.concurrent:
+            with self._lock:
+                pools, self._thread_pools = self._thread_pools, []
+        else:
+            pools = [self._open_datasets]
+        for open_datasets in pools:
+            for path in list(open_datasets):
+                self._close_dataset(path, open_datasets)
+
+    def get_time_ranges(self):
+        """
+        Return a dict mapping each time range (min, max) in the catalogue to a list of the paths of
+        the files covering it.
+        """
+        time_ranges = {}
+        for path, entry in self.catalogue.items():
+            if entry is not None and entry['time range'] is not None:
+                time_ranges.setdefault(entry['time range'], []).append(path)
+        return time_ranges
+
+
+class _LookupHints:
+
+    def __init__(self):
+        self.last_used_dataset = None
+
+
+class _ThreadLookupHints(threading.local):
+
+    def __init__(self):
+        self.last_used_dataset = None
+
 
 class Variable:
     """
@@ -116,58 +402,191 @@ class Variable:
     without having to manually access various netCDF files.
 
     See the Inventory class documentation for a short example.
+
+    Data may be preloaded into memory with the preload method. The storage mode selects how data
+    kept in memory, by preload or by a prefetcher, is stored. See ecmwf.storage.
+
+    By default a lookup of a point outside the coverage of the files raises a RuntimeError. If
+    out_of_coverage is 'nan' such lookups, including lookups of points with NaN coordinates, instead
+    return NaN, in __getitem__ as well as in get_values. This allows e.g. trajectories leaving the
+    domain to be handled without exceptions, see trajlib.methods.left_domain.
     """
 
-    def __init__(self, name, type_, inventory=None):
+    OUT_OF_COVERAGE_MODES = ('raise', 'nan')
+
+    def __init__(self, name, type_, inventory=None, storage='float64', out_of_coverage='raise'):
+        ecmwf_storage.check_storage(storage)
+        if out_of_coverage not in self.OUT_OF_COVERAGE_MODES:
+            raise ValueError('Unknown out of coverage mode ' + repr(out_of_coverage) + '.')
         self.name = name
         self.type = type_ if isinstance(type_, tuple) else tuple(type_)
         self.inventory = inventory
         self.dataset_ranges = {}
         self.dataset_indexing = {}
-        self.last_used_dataset = None
+        concurrent = inventory is not None and inventory.concurrent
+        self._hints = _ThreadLookupHints() if concurrent else _LookupHints()
         self.interpolation = interpolation.interpolate_lerp
+        self.storage = storage
+        self.out_of_coverage = out_of_coverage
+        self.preloaded = {}  # Path -> (array, read function, unpacking), see preload.
+        self._packings = {}
 
     def __getitem__(self, item):
+        metrics = self.inventory.metrics if self.inventory is not None else None
+        if metrics is None:
+            dataset = self._find_dataset(item)
+            return self._access_dataset(dataset, item) if dataset is not None else math.nan
+        start = time.perf_counter()
+        dataset = self._find_dataset(item, metrics)
+        value = self._access_dataset(dataset, item) if dataset is not None else math.nan
+        metrics.count('lookups')
+        metrics.add_time('lookup', time.perf_counter() - start)
+        return value
+
+    def get_values(self, items, mode='chunks'):
+        """
+        Look up the values at several points at once, reading each needed chunk of the netCDF
+        variable only once. See ecmwf.planner.ReadPlanner.
+        :param items: A sequence of points, each as given to __getitem__.
+        :param mode: The mode of the planner, chunks or bounds.
+        :return: A list of values in the order of the points.
+        """
+        return planner.ReadPlanner(self, mode=mode).lookup(items)
+
+    @property
+    def last_used_dataset(self):
+        return self._hints.last_used_dataset
+
+    @last_used_dataset.setter
+    def last_used_dataset(self, dataset):
+        self._hints.last_used_dataset = dataset
+
+    def _find_dataset(self, item, metrics=None):
+        hints = self._hints
         if len(item) != len(self.type):
             raise Exception('Invalid number of values to Variable.__getitem__')
-        elif self.last_used_dataset is not None and self._dataset_in_range(self.last_used_dataset, item):
-            return self._access_dataset(self.last_used_dataset, item)
+        elif hints.last_used_dataset is not None and self._dataset_in_range(hints.last_used_dataset, item):
+            if metrics is not None:
+                metrics.count('last used hits')
+            return hints.last_used_dataset
         else:
+            if metrics is not None:
+                metrics.count('last used misses')
             for dataset in self.dataset_ranges:
                 if self._dataset_in_range(dataset, item):
-                    self.last_used_dataset = dataset
-                    return self._access_dataset(dataset, item)
+                    hints.last_used_dataset = dataset
+                    return dataset
             else:
+                if self.out_of_coverage == 'nan':
+                    return None
                 raise RuntimeError('No data available for variable ' + self.name + ' at requested point ' + str(item))
 
     def _dataset_in_range(self, dataset, values):
-        ranges = self.dataset_ranges[dataset]
+        ranges = self.dataset_ranges.get(dataset)
+        if ranges is None:
+            return False  # E.g. a last used dataset removed by Inventory.refresh in another thread.
         for value, min_value, max_value in zip(values, *zip(*ranges)):
             if not min_value <= value <= max_value:
                 return False
         else:
             return True
 
-    def _access_dataset(self, dataset, values):
+    def _access_dataset(self, dataset, values, read=None):
+        # The optional read function takes file indices and returns the value there, see _reader.
         indexing = self.dataset_indexing[dataset]  # A tuple of (indices, sorted values) for each axis.
         interpolation_parameters = tuple(self.interpolation(values[idx], indexing[idx][1])
                                          for idx in range(len(values)))
-        data = self.inventory.open_dataset(dataset)
+        unpacking = None
+        if read is None:
+            read, unpacking = self._reader(dataset, values)
 
         def get_value(indices=()):
             index_count = len(indices)
             if index_count == len(values):
-                return data.variables[self.name][indices]
+                return read(indices)
             else:
                 params = interpolation_parameters[index_count]
                 return sum(get_value(indices + (indexing[index_count][0][index_index], )) * factor
                            for index_index, factor in params)
 
-        return get_value()
+        if unpacking is None:
+            return get_value()
+        scale, offset = unpacking
+        return get_value() * scale + offset
+
+    def _reader(self, dataset, values):
+        # Returns a function reading the value at the given file indices of the dataset, and the
+        # (scale, offset) to apply to interpolated values if it reads packed values, or None.
+        preloaded = self.preloaded.get(dataset)
+        if preloaded is not None:
+            return preloaded[1:]
+        inventory = self.inventory
+        if inventory.prefetcher is not None:
+            return inventory.prefetcher.reader(self, dataset, values)
+        nc_var = inventory.open_dataset(dataset).variables[self.name]
+        metrics = inventory.metrics
+        io_lock = inventory.io_lock
+        if metrics is None and io_lock is None:
+            return nc_var.__getitem__, None
+
+        def instrumented_read(indices):
+            if io_lock is not None:
+                with io_lock:
+                    value = nc_var[indices]
+            else:
+                value = nc_var[indices]
+            if metrics is not None:
+                metrics.count_dataset(dataset, 'reads')
+                metrics.count_dataset(dataset, 'bytes read', nc_var.dtype.itemsize * value.size)
+            return value
+
+        return instrumented_read, None
+
+    def unpacking(self, dataset):
+        """
+        Return the (scale, offset) to apply to values interpolated from data of the given dataset
+        kept in memory, or None if it is kept unpacked.
+        """
+        packing = self._packings.get(dataset) if self.storage == 'packed' else None
+        return packing[:2] if packing is not None else None
+
+    def preload(self, paths=None):
+        """
+        Read the whole variable from the given files into memory, in the storage mode of the
+        variable. Lookups in preloaded files are served from memory, also outside of the context
+        of the inventory. The inventory must be used as a context manager while preloading.
+        :param paths: The paths of the files to preload. Defaults to all files of the variable.
+        :return: The number of bytes of memory used by all preloaded data of the variable.
+        """
+        inventory = self.inventory
+        index = tuple(slice(None) for _ in self.type)
+        for path in (self.dataset_ranges if paths is None else paths):
+            if path in self.preloaded:
+                continue
+            with inventory.io_guard():
+                nc_var = inventory.open_dataset(path).variables[self.name]
+                array, packing = ecmwf_storage.read_stored(nc_var, index, self.storage)
+            if inventory.metrics is not None:
+                inventory.metrics.count_dataset(path, 'reads')
+                inventory.metrics.count_dataset(path, 'bytes read', nc_var.dtype.itemsize * array.size)
+            self.preloaded[path] = (array, ecmwf_storage.array_reader(array, packing),
+                                    packing[:2] if packing is not None else None)
+        return self.preloaded_bytes()
+
+    def release(self, paths=None):
+        """
+        Drop preloaded data of the given files, by default of all files.
+        """
+        for path in (list(self.preloaded) if paths is None else paths):
+            self.preloaded.pop(path, None)
+
+    def preloaded_bytes(self):
+        return sum(array.nbytes for array, _, _ in self.preloaded.values())
 
     def add_file(self, path):
-        with netCDF4.Dataset(path) as dataset:
+        with open_file(path) as dataset:
             assert dataset.variables[self.name].dimensions == self.type
+            self._packings[path] = ecmwf_storage.packing(dataset.variables[self.name])
             margins = [dataset.variables[axis][:] for axis in self.type]
             enumerated_margins = (sorted(enumerate(margin), key=lambda x: x[1]) for margin in margins)
             indexing = [tuple(zip(*margin)) for margin in enumerated_margins]
@@ -182,6 +601,17 @@ class Variable:
             ranges = tuple((min(values), max(values)) for _, values in indexing)
             self.dataset_ranges[path] = ranges
 
+    def remove_file(self, path):
+        """
+        Remove a file from the variable, e.g. when it has been removed from the inventory.
+        """
+        self.dataset_ranges.pop(path, None)
+        self.dataset_indexing.pop(path, None)
+        self._packings.pop(path, None)
+        self.preloaded.pop(path, None)
+        if self.last_used_dataset == path:
+            self.last_used_dataset = None
+
     def get_coverage(self, subspace=None):
         if subspace is None:
             subspace = tuple(None for _ in self.type)
@@ -0,0 +1,125 @@
+"""
+This module provides a Metrics class for opt-in instrumentation of the hot paths of data access
+and trajectory integration.
+
+Instrumentation is enabled by giving a Metrics object to an Inventory (and optionally to the
+trajlib integrators). When no Metrics object is given the instrumented code only pays for a check
+against None.
+
+Example:
+
+    metrics = ecmwf.metrics.Metrics()
+    inventory = ecmwf.inventory.Inventory(metrics=metrics)
+    ...
+    for point in trajlib.integrate(start, uvw_func, dt, duration, metrics=metrics):
+        ...
+    metrics.report()
+
+"""
+
+
+import collections
+import sys
+import threading
+
+
+class Metrics:
+    """
+    Collects counters, per dataset counters and timers.
+
+    Counters recorded by the ecmwf and trajlib packages are:
+
+     * lookups - Calls to Variable.__getitem__.
+     * last used hits / last used misses - Whether a lookup was served by the last used dataset.
+     * reads - Reads from netCDF variables.
+     * bytes read - Bytes read from netCDF variables, as stored in the files.
+     * datasets opened - Datasets opened by Inventory.open_dataset.
+     * datasets closed - Datasets closed by the Inventory, e.g. when the pool of open datasets is full.
+     * uvw evaluations - Calls to the velocity function during integration.
+     * integration steps - Integration steps taken.
+     * particles frozen - Trajectories which left the domain during integration.
+
+    The counters reads, bytes read, datasets opened and datasets closed are also recorded per
+    dataset. The timer lookup records the wall time of each call to Variable.__getitem__, and the
+    timer planned lookups the wall time of each batch executed by an ecmwf.planner.ReadPlanner.
+
+    Metrics may be recorded from several threads at once.
+    """
+
+    def __init__(self):
+        self.counters = None
+        self.dataset_counters = None
+        self.timers = None
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = collections.Counter()
+            self.dataset_counters = collections.defaultdict(collections.Counter)
+            self.timers = {}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def count_dataset(self, path, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+            self.dataset_counters[path][name] += amount
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds < timer[2]:
+                    timer[2] = seconds
+                if seconds > timer[3]:
+                    timer[3] = seconds
+
+    def summary(self):
+        """
+        Return a dict summarizing the collected metrics, suitable for e.g. JSON serialization.
+        """
+        with self.lock:
+            counters = collections.Counter(self.counters)
+            timer_values = dict((name, tuple(timer)) for name, timer in self.timers.items())
+            dataset_counters = dict((path, dict(path_counters)) for path, path_counters in self.dataset_counters.items())
+
+        def ratio(numerator, denominator):
+            return counters[numerator] / counters[denominator] if counters[denominator] > 0 else None
+
+        hits, misses = counters['last used hits'], counters['last used misses']
+        derived = {
+            'last used hit rate': hits / (hits + misses) if hits + misses > 0 else None,
+            'reads per lookup': ratio('reads', 'lookups'),
+            'uvw evaluations per step': ratio('uvw evaluations', 'integration steps'),
+        }
+        timers = dict((name, {'count': count, 'total': total, 'mean': total / count, 'min': min_, 'max': max_})
+                      for name, (count, total, min_, max_) in timer_values.items())
+        return {'counters': dict(counters), 'derived': derived, 'timers': timers, 'datasets': dataset_counters}
+
+    def report(self, file=sys.stdout):
+        """
+        Print a human readable report of the collected metrics.
+        :param file: The file to print to. Defaults to stdout.
+        """
+        summary = self.summary()
+        print('<ecmwf.metrics.Metrics>', file=file)
+        for name, value in sorted(summary['counters'].items()):
+            print('   ', name, '=', value, file=file)
+        for name, value in sorted(summary['derived'].items()):
+            if value is not None:
+                print('   ', name, '= %.3f' % value, file=file)
+        for name, timer in sorted(summary['timers'].items()):
+            print('   ', name, 'time = %.6f s total, %d calls, %.6f s mean, %.6f s min, %.6f s max' %
+                  (timer['total'], timer['count'], timer['mean'], timer['min'], timer['max']), file=file)
+        for path, counters in sorted(summary['datasets'].items()):
+            print('   ', path, file=file)
+            for name, value in sorted(counters.items()):
+                print('   ', '   ', name, '=', value, file=file)
+        print('', file=file)
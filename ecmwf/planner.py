@@ -0,0 +1,191 @@
+"""
+This module provides a ReadPlanner class which coalesces the reads of many point lookups of a
+variable into reads of whole chunks of the netCDF variables.
+
+A lookup through Variable.__getitem__ reads the value of every corner of its interpolation stencil
+with a separate netCDF read. For chunked (and in particular compressed) variables every such read
+decompresses the whole chunk holding the corner, so nearby lookups decompress the same chunks over
+and over. The planner instead collects pending lookups, maps the stencil corners of all of them to
+the native chunk layout of the variable in each file (netCDF4.Variable.chunking), reads each needed
+chunk exactly once and serves all lookups from the chunks read. Variables which are not chunked,
+i.e. stored contiguously or in netCDF3 files, have no decompression to avoid, so their needed
+values are read as in the bounds mode below.
+
+Alternatively, in the bounds mode, the planner reads the bounding block of all corners needed from
+each file with a single read. This suits lookups which are known to lie close together, such as
+the points of a cross section at one time. Blocks are split where the corners along an axis leave
+a large gap, e.g. between the two ends of the longitude axis of a global grid when the lookups
+cross its wrap, so that the gap is not read.
+
+The values are identical to those of Variable.__getitem__. The chunks are only kept for the
+duration of one execution, so the lookups of a batch should be reasonably close together. All
+netCDF access is done within Inventory.io_guard, so planned lookups may be mixed with a prefetcher.
+
+Example:
+
+    with inventory:
+        values = u_wind.get_values(points)
+        # Or, collecting lookups as they come:
+        planner = ecmwf.planner.ReadPlanner(u_wind)
+        tickets = [planner.add(point) for point in points]
+        values = planner.execute()
+
+"""
+
+
+import math
+import time
+
+
+class ReadPlanner:
+    """
+    Collects point lookups of a variable and serves them by reading each needed chunk once. See
+    the module documentation.
+    """
+
+    MODES = ('chunks', 'bounds')
+    # The smallest number of unneeded indices along an axis worth a separate read in the bounds mode.
+    MIN_SPLIT_GAP = 8
+
+    def __init__(self, variable, chunk_shapes=None, mode='chunks'):
+        """
+        :param variable: The ecmwf.inventory.Variable to read from. Its inventory must be used as
+        a context manager while executing.
+        :param chunk_shapes: An optional dict mapping dataset paths to the shape of the blocks to
+        read, overriding the chunk layout of the files. A shape of None reads as in the bounds mode.
+        :param mode: Either chunks, reading each needed chunk once, or bounds, reading the bounding
+        block of the needed values once per file.
+        """
+        if mode not in self.MODES:
+            raise ValueError('Unknown read planner mode ' + repr(mode) + '.')
+        self.variable = variable
+        self.mode = mode
+        self.chunk_shapes = dict(chunk_shapes or {})
+        self.pending = []
+        self.blocks_read = 0
+
+    def add(self, item):
+        """
+        Add a lookup of the value at the given point.
+        :return: The index of the value in the list returned by execute.
+        """
+        self.pending.append(tuple(item))
+        return len(self.pending) - 1
+
+    def lookup(self, items):
+        """
+        Add lookups at the given points and execute all pending lookups.
+        :return: A list of the values of all pending lookups, in the order they were added.
+        """
+        for item in items:
+            self.add(item)
+        return self.execute()
+
+    def execute(self):
+        """
+        Read the chunks needed by the pending lookups and return their values in the order they
+        were added.
+        """
+        items, self.pending = self.pending, []
+        variable = self.variable
+        metrics = variable.inventory.metrics
+        start = time.perf_counter()
+        datasets = [variable._find_dataset(item, metrics) for item in items]
+        # First compute the stencils, recording the file indices of their corners.
+        # Data preloaded into the variable is used as is.
+        corners = {}
+        for item, dataset in zip(items, datasets):
+            if dataset is not None and dataset not in variable.preloaded:
+                needed = corners.setdefault(dataset, set())
+                variable._access_dataset(dataset, item, read=self._recorder(needed))
+        read_blocks = self._read_chunks if self.mode == 'chunks' else self._read_bounds
+        readers = dict((dataset, read_blocks(dataset, needed)) for dataset, needed in corners.items())
+        # Lookups outside the coverage have no dataset when the variable returns NaN for them.
+        values = [variable._access_dataset(dataset, item, read=readers.get(dataset))
+                  if dataset is not None else math.nan
+                  for item, dataset in zip(items, datasets)]
+        if metrics is not None:
+            metrics.count('lookups', len(items))
+            metrics.add_time('planned lookups', time.perf_counter() - start)
+        return values
+
+    @staticmethod
+    def _recorder(needed):
+
+        def record(indices):
+            needed.add(indices)
+            return 0
+
+        return record
+
+    def _chunk_shape(self, dataset, nc_var):
+        # Returns the chunk shape of the variable, or None if it is not chunked. netCDF4 gives None
+        # for the variables of netCDF3 files.
+        if dataset not in self.chunk_shapes:
+            chunking = nc_var.chunking()
+            self.chunk_shapes[dataset] = tuple(chunking) if chunking not in (None, 'contiguous') else None
+        return self.chunk_shapes[dataset]
+
+    def _read_chunks(self, dataset, needed):
+        # Reads the chunks holding the needed indices and returns a function reading from them.
+        inventory = self.variable.inventory
+        with inventory.io_guard():
+            nc_var = inventory.open_dataset(dataset).variables[self.variable.name]
+            chunk_shape = self._chunk_shape(dataset, nc_var)
+            if chunk_shape is None:
+                return self._read_bounds(dataset, needed)
+            keys = set(tuple(index // size for index, size in zip(indices, chunk_shape)) for indices in needed)
+            chunks = {}
+            for key in keys:
+                index = tuple(slice(position * size, min((position + 1) * size, length))
+                              for position, size, length in zip(key, chunk_shape, nc_var.shape))
+                chunks[key] = self._read_block(dataset, nc_var, index)
+
+        def read(indices):
+            key = tuple(index // size for index, size in zip(indices, chunk_shape))
+            return chunks[key][tuple(index % size for index, size in zip(indices, chunk_shape))]
+
+        return read
+
+    def _read_bounds(self, dataset, needed):
+        # Reads the bounding blocks of the needed indices and returns a function reading from them.
+        inventory = self.variable.inventory
+        values = {}
+        with inventory.io_guard():
+            nc_var = inventory.open_dataset(dataset).variables[self.variable.name]
+            for group in self._split_bounds(list(needed)):
+                lower = tuple(min(axis_indices) for axis_indices in zip(*group))
+                upper = tuple(max(axis_indices) + 1 for axis_indices in zip(*group))
+                block = self._read_block(dataset, nc_var, tuple(slice(*bounds) for bounds in zip(lower, upper)))
+                for indices in group:
+                    values[indices] = block[tuple(index - offset for index, offset in zip(indices, lower))]
+        return values.__getitem__
+
+    @classmethod
+    def _split_bounds(cls, needed):
+        # Splits the needed indices into groups at the gaps between consecutive indices along an axis
+        # which span more than half the bounding range along that axis.
+        groups, pending = [], [needed]
+        while pending:
+            group = pending.pop()
+            for axis in range(len(group[0])):
+                axis_indices = sorted(set(indices[axis] for indices in group))
+                gaps = [(high - low - 1, high) for low, high in zip(axis_indices, axis_indices[1:])]
+                gap, split = max(gaps) if gaps else (0, None)
+                if gap >= cls.MIN_SPLIT_GAP and 2 * gap > axis_indices[-1] - axis_indices[0] + 1:
+                    pending.append([indices for indices in group if indices[axis] < split])
+                    pending.append([indices for indices in group if indices[axis] >= split])
+                    break
+            else:
+                groups.append(group)
+        return groups
+
+    def _read_block(self, dataset, nc_var, index):
+        # Must be called within the io_guard of the inventory.
+        inventory = self.variable.inventory
+        block = nc_var[index]
+        self.blocks_read += 1
+        if inventory.metrics is not None:
+            inventory.metrics.count_dataset(dataset, 'reads')
+            inventory.metrics.count_dataset(dataset, 'bytes read', nc_var.dtype.itemsize * block.size)
+        return block
@@ -0,0 +1,173 @@
+"""
+This module provides a Prefetcher class which loads upcoming time slabs of variables on a background
+thread, so that reading data overlaps with computation, e.g. trajectory integration.
+
+Trajectories move monotonically in time, so which time steps of the data will be needed next is
+predictable from the integration direction. A prefetcher is enabled on an Inventory with
+Inventory.enable_prefetch. Lookups through Variable.__getitem__ then read from whole time slabs
+(one time step of the variable) kept in memory in the storage mode of the variable (see
+ecmwf.storage), and the slabs bracketing the looked up time as well
+as the next slab in the direction of integration are loaded in the background. When the next slab
+lies beyond the end of the current file the first slabs of the next file, found through the
+dataset_ranges of the variable, are loaded instead.
+
+Example:
+
+    with inventory:
+        inventory.enable_prefetch(dt=-1)  # Backwards in time, in the unit of the time axis.
+        for point in trajlib.integrate(...):
+            ...
+
+"""
+
+
+import bisect
+import collections
+import concurrent.futures
+import threading
+
+from . import storage
+
+
+class _VariableState:
+
+    def __init__(self, variable):
+        self.time_axis = variable.type.index('time')
+        self.slabs = collections.OrderedDict()  # (dataset, time index) -> future
+        self.dataset = None
+        self.bracket = None
+
+
+class Prefetcher:
+    """
+    Keeps recently used and upcoming time slabs of variables in memory, loading them on a
+    background thread. See the module documentation.
+
+    All access to the netCDF files of the inventory is serialized through the lock of the
+    prefetcher, since netCDF4 handles may not be used from several threads at once.
+    """
+
+    def __init__(self, inventory, dt, max_slabs=4):
+        """
+        :param inventory: The Inventory whose datasets are read.
+        :param dt: The time step of the integration, in the unit of the time axis of the data. Only
+        the sign (direction of integration) and magnitude when crossing files are used.
+        :param max_slabs: The maximum number of slabs kept in memory per variable. At least three.
+        """
+        if max_slabs < 3:
+            raise ValueError('The prefetcher needs to keep at least three slabs per variable.')
+        self.inventory = inventory
+        self.dt = dt
+        self.max_slabs = max_slabs
+        self.lock = threading.RLock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.states = {}
+
+    def _state(self, variable):
+        state = self.states.get(variable)
+        if state is None:
+            state = _VariableState(variable)
+            self.states[variable] = state
+        return state
+
+    def reader(self, variable, dataset, item):
+        """
+        Return a function reading values of the given variable from the given dataset by file
+        indices, and the unpacking to apply to interpolated values (see Variable.unpacking). The
+        lookup of item is used to schedule loading of upcoming slabs.
+        """
+        if 'time' not in variable.type:
+            def read_locked(indices):
+                with self.lock:
+                    return self.inventory.open_dataset(dataset).variables[variable.name][indices]
+            return read_locked, None
+        state = self._state(variable)
+        self._notify(variable, state, dataset, item)
+        time_axis = state.time_axis
+        metrics = self.inventory.metrics
+
+        def read(indices):
+            future = state.slabs.get((dataset, indices[time_axis]))
+            if future is not None:
+                if metrics is not None:
+                    metrics.count('prefetch hits')
+                return future.result()(indices[:time_axis] + indices[time_axis + 1:])
+            if metrics is not None:
+                metrics.count('prefetch misses')
+            with self.lock:
+                nc_var = self.inventory.open_dataset(dataset).variables[variable.name]
+                value = storage.read_stored(nc_var, indices, variable.storage)
+            return storage.array_reader(*value)(())
+
+        return read, variable.unpacking(dataset)
+
+    def _notify(self, variable, state, dataset, item):
+        time_value = item[state.time_axis]
+        if state.dataset == dataset and state.bracket[0] <= time_value <= state.bracket[1]:
+            return
+        indices, values = variable.dataset_indexing[dataset][state.time_axis]
+        upper = min(max(bisect.bisect(values, time_value), 1), len(values) - 1)
+        lower = upper - 1
+        state.dataset = dataset
+        state.bracket = values[lower], values[upper]
+        self._schedule(variable, state, dataset, indices[lower])
+        self._schedule(variable, state, dataset, indices[upper])
+        # Also load the next slab in the direction of integration, from the next file if needed.
+        next_position = upper + 1 if self.dt > 0 else lower - 1
+        if 0 <= next_position < len(values):
+            self._schedule(variable, state, dataset, indices[next_position])
+            return
+        edge = values[-1] if self.dt > 0 else values[0]
+        time_axis = state.time_axis
+        next_item = tuple(item[:time_axis]) + (edge + self.dt,) + tuple(item[time_axis + 1:])
+        for next_dataset in variable.dataset_ranges:
+            if next_dataset != dataset and variable._dataset_in_range(next_dataset, next_item):
+                next_indices, next_values = variable.dataset_indexing[next_dataset][time_axis]
+                next_position = 0 if self.dt > 0 else len(next_values) - 1
+                self._schedule(variable, state, next_dataset, next_indices[next_position])
+                break
+
+    def _schedule(self, variable, state, dataset, time_index):
+        key = (dataset, time_index)
+        if key in state.slabs:
+            state.slabs.move_to_end(key)
+            return
+        state.slabs[key] = self.executor.submit(self._load, variable, dataset, time_index, state.time_axis)
+        while len(state.slabs) > self.max_slabs:
+            state.slabs.popitem(last=False)
+
+    def _load(self, variable, dataset, time_index, time_axis):
+        import numpy
+        index = tuple(time_index if axis == time_axis else slice(None) for axis in range(len(variable.type)))
+        with self.lock:
+            nc_var = self.inventory.open_dataset(dataset).variables[variable.name]
+            slab, packing = storage.read_stored(nc_var, index, variable.storage)
+        metrics = self.inventory.metrics
+        if metrics is not None:
+            metrics.count_dataset(dataset, 'reads')
+            metrics.count_dataset(dataset, 'bytes read', nc_var.dtype.itemsize * numpy.size(slab))
+        return storage.array_reader(slab, packing)
+
+    def drop_dataset(self, dataset):
+        """
+        Drop all slabs from the given dataset, e.g. when it is closed.
+        """
+        for state in self.states.values():
+            for key in [key for key in state.slabs if key[0] == dataset]:
+                state.slabs.pop(key).cancel()
+            if state.dataset == dataset:
+                state.dataset = None
+
+    def clear(self):
+        """
+        Wait for any pending loads and drop all slabs.
+        """
+        futures = [future for state in self.states.values() for future in state.slabs.values()]
+        for future in futures:
+            future.cancel()
+        concurrent.futures.wait(futures)
+        self.states = {}
+
+    def shutdown(self):
+        self.clear()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,88 @@
+"""
+This module provides the storage modes in which variables keep data in memory, e.g. the time slabs
+of the prefetcher (see ecmwf.prefetch) and arrays preloaded with Variable.preload.
+
+ECMWF netCDF data is typically stored as packed shorts with the attributes scale_factor and
+add_offset, which netCDF4 unpacks to float64 on every read, inflating the data four times. The
+storage mode of a Variable selects how data is kept in memory:
+
+ * float64 - Unpacked double precision values, with NaN for missing values. The default.
+ * float32 - Unpacked single precision values, with NaN for missing values. Halves the memory.
+ * packed - The packed integers as stored in the files, quartering the memory for packed shorts.
+   Since interpolation is linear, the scale and offset are only applied to the interpolated value.
+   Missing values interpolate to NaN. Variables which are not packed are kept as float32.
+
+Values read from memory are converted to double precision before interpolation, so interpolation
+is done in double precision whatever the storage mode.
+"""
+
+
+STORAGE_MODES = ('float64', 'float32', 'packed')
+
+
+def check_storage(storage):
+    if storage not in STORAGE_MODES:
+        raise ValueError('Unknown storage mode ' + repr(storage) + ', expected one of ' + str(STORAGE_MODES) + '.')
+
+
+def packing(nc_var):
+    """
+    Return a tuple (scale factor, add offset, fill value) describing how the values of the given
+    netCDF variable are packed, or None if it is not packed. The fill value may be None.
+    """
+    attributes = nc_var.ncattrs()
+    if 'scale_factor' not in attributes and 'add_offset' not in attributes:
+        return None
+    if nc_var.dtype.kind not in 'iu':
+        return None
+    scale = float(nc_var.getncattr('scale_factor')) if 'scale_factor' in attributes else 1.0
+    offset = float(nc_var.getncattr('add_offset')) if 'add_offset' in attributes else 0.0
+    fill = None
+    for name in ('_FillValue', 'missing_value'):
+        if name in attributes:
+            fill = int(nc_var.getncattr(name))
+            break
+    return scale, offset, fill
+
+
+def read_stored(nc_var, index, storage):
+    """
+    Read from a netCDF variable into an array in the given storage mode.
+    :return: A tuple (array, packing) where packing is as returned by the packing function if the
+    array holds packed values, otherwise None.
+    """
+    import numpy
+    if storage == 'packed':
+        var_packing = packing(nc_var)
+        if var_packing is not None:
+            nc_var.set_auto_scale(False)
+            try:
+                data = nc_var[index]
+            finally:
+                nc_var.set_auto_scale(True)
+            fill = var_packing[2]
+            if fill is not None:
+                data = numpy.ma.filled(data, fill)
+            return numpy.asarray(data, dtype=nc_var.dtype), var_packing
+    dtype = numpy.float64 if storage == 'float64' else numpy.float32
+    return numpy.ma.filled(numpy.ma.asarray(nc_var[index], dtype=dtype), numpy.nan), None
+
+
+def array_reader(array, array_packing):
+    """
+    Return a function reading double precision values from an array returned by read_stored,
+    given indices into the array. Packed values are not unpacked, but missing values read as NaN.
+    """
+    import numpy
+    float64 = numpy.float64
+    if array_packing is None or array_packing[2] is None:
+        def read(indices):
+            return float64(array[indices])
+    else:
+        fill = array_packing[2]
+        nan = float64(numpy.nan)
+
+        def read(indices):
+            value = array[indices]
+            return nan if value == fill else float64(value)
+    return read
@@ -2,6 +2,9 @@
 This module provides functions to convert to and from the ECMFW time format.
 
 ECMWF handles time as hours from Januari 1st 1900.
+
+Besides the functions working on single datetime objects there are functions working on whole
+arrays at a time using numpy datetime64 values, for when many points need converting.
 """
 
 
@@ -27,3 +30,43 @@ def ecmwf_hours_to_datetime(hours):
     :return: A standard datetime object.
     """
     return ECMWF_EPOCH + datetime.timedelta(hours=int(hours))  # int cast in case of numpy integer.
+
+
+def datetimes_to_ecmwf_hours(datetimes):
+    """
+    Convert an array of times to ECMWF time.
+    :param datetimes: An array of numpy datetime64 values, or a sequence of datetime objects.
+    :return: A numpy array of hours from the ECMWF epoch.
+    """
+    import numpy
+    values = numpy.asarray(datetimes, dtype='datetime64[us]')
+    return (values - numpy.datetime64(ECMWF_EPOCH, 'us')) / numpy.timedelta64(1, 'h')
+
+
+def ecmwf_hours_to_datetimes(hours):
+    """
+    Convert an array of ECMWF times. Like ecmwf_hours_to_datetime only the integer part is used.
+    :param hours: An array of hours from the ECMWF epoch.
+    :return: A numpy array of datetime64 values with a resolution of hours.
+    """
+    import numpy
+    whole_hours = numpy.trunc(numpy.asarray(hours)).astype(numpy.int64)
+    return numpy.datetime64('1900-01-01T00', 'h') + whole_hours.astype('timedelta64[h]')
+
+
+def ymdhs_to_ecmwf_hours(ymdhs):
+    """
+    Convert an array of times in the (year, month, day, hour, seconds) format used by the ESX
+    startdate configuration option to ECMWF time.
+    :param ymdhs: An array with five values along the last axis.
+    :return: A numpy array of hours from the ECMWF epoch, with the shape of ymdhs minus the last axis.
+    """
+    import numpy
+    values = numpy.asarray(ymdhs, dtype=numpy.int64)
+    if values.shape[-1:] != (5,):
+        raise ValueError('Expected an array with five values along the last axis.')
+    years = (values[..., 0] - 1970).astype('datetime64[Y]')
+    months = years.astype('datetime64[M]') + (values[..., 1] - 1).astype('timedelta64[M]')
+    days = months.astype('datetime64[D]') + (values[..., 2] - 1).astype('timedelta64[D]')
+    seconds = days.astype('datetime64[s]') + (values[..., 3] * 3600 + values[..., 4]).astype('timedelta64[s]')
+    return datetimes_to_ecmwf_hours(seconds)
@@ -1,9 +1,10 @@
 """
 This package provides some basic helpers for plotting projected data using pyplot.
+
+Importing matplotlib.pyplot is slow, so it is imported when first plotting.
 """
 
 
-import matplotlib.pyplot as pyplot
 from . import projections
 
 
@@ -49,6 +50,7 @@ def plot_projected_line(lats=None, lons=None, latlons=None,
         return False
     #
     x, y = zip(*scaled)
+    import matplotlib.pyplot as pyplot
     pyplot.plot(x, y, **kwargs)
 
 
@@ -1,12 +1,34 @@
 """
 This module provides some help with using projections.
+
+Importing pyproj is slow, so it is imported when a projection is first used.
 """
 
 
-import pyproj
+class _LazyProj:
+    """
+    Stands in for a pyproj.Proj object, which is created with the given keyword arguments when first used.
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.proj = None
+
+    def _get_proj(self):
+        if self.proj is None:
+            import pyproj
+            self.proj = pyproj.Proj(**self.kwargs)
+        return self.proj
+
+    def __call__(self, *args, **kwargs):
+        return self._get_proj()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._get_proj(), name)
+
 
 Identity = lambda lon, lat: (lon, lat)
-Mercator = pyproj.Proj(proj='merc', ellps='WGS84')
+Mercator = _LazyProj(proj='merc', ellps='WGS84')
 
 
 def get_stereographic(lat, lon, k=1):
@@ -17,4 +39,5 @@ def get_stereographic(lat, lon, k=1):
     :param k: The scaling factor in the projection center. Defaults to one.
     :return: A stereographic projection with the given parameters.
     """
+    import pyproj
     return pyproj.Proj(proj='sterea', ellps='WGS84', lat_0=lat, lon_0=lon, k_0=k)
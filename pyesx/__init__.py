@@ -5,3 +5,4 @@ This package provides helpers for running ESX from python.
 
 from .config import *
 from .namelist import Namelist, NamelistSection
+from . import monitor
@@ -0,0 +1,295 @@
+"""
+This module provides a RunMonitor class for running ESX executables while following their
+progress.
+
+The output of the child process (stdout, with stderr merged into it) is read on a background
+thread, so it can be followed without blocking, e.g. to spot stuck runs. Lines reporting the
+simulated time are recognized with a regular expression and compared against the endTime and
+dt_extern of the pyesx.Config of the run. The wall time is recorded per phase of the run:
+
+ * startup - From starting the process until the first simulated time is reported.
+ * integration - Until the simulated time reaches endTime, or the last report if it never does.
+ * shutdown - From then until the process exits.
+
+The peak memory of the child is sampled from /proc while it runs (VmHWM, Linux only), falling
+back to the resource usage of terminated children where available. When the run ends a metrics
+record is returned, including the uses_chem, uses_diff and uses_mafor options of the config, and
+optionally appended as a line of JSON to a file for comparing runs.
+
+Example:
+
+    config = pyesx.Config()
+    config.read('config_esx.nml')
+    monitor = pyesx.monitor.RunMonitor(['./esx'], config=config, cwd='ESX',
+                                       metrics_path='esx_runs.jsonl')
+    monitor.start()
+    while monitor.running:
+        monitor.poll(timeout=10)
+        print('%.0f %%' % (100 * (monitor.progress or 0)), monitor.phase)
+    record = monitor.wait()
+
+"""
+
+
+import datetime
+import json
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+
+
+# Matches e.g. "time = 3600.0" or "Time: 1.2E+03". The first group is the simulated time in seconds.
+DEFAULT_TIME_PATTERN = r'(?i)\btime\s*[=:]\s*([-+]?\d+(?:\.\d*)?(?:[eEdD][-+]?\d+)?)'
+
+PHASES = ('startup', 'integration', 'shutdown')
+
+
+def _peak_memory_kb(pid):
+    # Returns the peak resident set size in kB of a running process, or None if unavailable.
+    try:
+        with open('/proc/%d/status' % pid, 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _children_peak_memory_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # Bytes on macOS, otherwise kB.
+
+
+class RunMonitor:
+    """
+    Runs an ESX executable and follows its progress. See the module documentation.
+    """
+
+    def __init__(self, args, config=None, cwd=None, time_pattern=DEFAULT_TIME_PATTERN, log_path=None,
+                 metrics_path=None, on_line=None):
+        """
+        :param args: The command to run, as for subprocess.Popen.
+        :param config: The pyesx.Config of the run, used for endTime, dt_extern and the uses_* options.
+        :param cwd: The working directory of the process.
+        :param time_pattern: Regular expression whose first group matches the simulated time in
+        seconds in a line of output.
+        :param log_path: Optional path of a file to which the output is written as it arrives.
+        :param metrics_path: Optional path of a file to which the metrics record is appended as a
+        line of JSON when the run ends.
+        :param on_line: Optional function called with each line of output, from poll.
+        """
+        self.args = args
+        self.config = config
+        self.cwd = cwd
+        self.time_pattern = re.compile(time_pattern)
+        self.log_path = log_path
+        self.metrics_path = metrics_path
+        self.on_line = on_line
+        driver = config.driver if config is not None else None
+        self.end_time = driver.endTime if driver is not None else None
+        self.dt_extern = driver.dt_extern if driver is not None else None
+        self.process = None
+        self.started = None
+        self.start_time = None
+        self.phase = None
+        self.phase_times = {}
+        self.simulated_time = None
+        self.time_reports = 0
+        self.last_progress_time = None
+        self.peak_memory_kb = None
+        self.lines = 0
+        self.tail = []
+        self.record = None
+        self._queue = queue.Queue()
+        self._reader = None
+        self._phase_start = None
+
+    def start(self):
+        if self.process is not None:
+            raise RuntimeError('The run has already been started.')
+        self.started = datetime.datetime.now()
+        self.start_time = time.perf_counter()
+        self._enter_phase('startup')
+        self.last_progress_time = self.start_time
+        self.process = subprocess.Popen(self.args, cwd=self.cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        universal_newlines=True, bufsize=1)
+        self._reader = threading.Thread(target=self._read_output, daemon=True)
+        self._reader.start()
+
+    def _read_output(self):
+        log = open(self.log_path, 'w') if self.log_path is not None else None
+        try:
+            for line in self.process.stdout:
+                if log is not None:
+                    log.write(line)
+                    log.flush()
+                self._queue.put(line)
+        finally:
+            if log is not None:
+                log.close()
+            self._queue.put(None)
+
+    def _enter_phase(self, phase):
+        now = time.perf_counter()
+        if self.phase is not None:
+            self.phase_times[self.phase] = self.phase_times.get(self.phase, 0.0) + now - self._phase_start
+        self.phase = phase
+        self._phase_start = now
+
+    @property
+    def running(self):
+        return self.process is not None and self._reader.is_alive()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start_time if self.start_time is not None else None
+
+    @property
+    def progress(self):
+        """
+        The fraction of endTime simulated so far, or None if unknown.
+        """
+        if self.simulated_time is None or not self.end_time:
+            return None
+        return min(self.simulated_time / self.end_time, 1.0)
+
+    @property
+    def steps(self):
+        """
+        The number of dt_extern steps simulated so far, or None if unknown.
+        """
+        if self.simulated_time is None or not self.dt_extern:
+            return None
+        return int(round(self.simulated_time / self.dt_extern))
+
+    def seconds_since_progress(self):
+        """
+        Return the wall time in seconds since the simulated time last advanced, or since the start.
+        """
+        return time.perf_counter() - self.last_progress_time
+
+    def poll(self, timeout=0):
+        """
+        Process the output available so far, waiting up to timeout seconds for the first line.
+        :return: A list of the lines processed.
+        """
+        lines = []
+        try:
+            line = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+            while True:
+                if line is None:
+                    self._queue.put(None)  # Keep the end marker for later polls.
+                    break
+                self._handle_line(line)
+                lines.append(line)
+                line = self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._sample_memory()
+        return lines
+
+    def _handle_line(self, line):
+        self.lines += 1
+        self.tail = (self.tail + [line.rstrip('\n')])[-20:]
+        if self.on_line is not None:
+            self.on_line(line)
+        match = self.time_pattern.search(line)
+        if match is None:
+            return
+        try:
+            simulated_time = float(match.group(1).replace('D', 'E').replace('d', 'e'))
+        except ValueError:
+            return
+        self.time_reports += 1
+        # Enter the integration phase before stamping the progress, which must not precede the
+        # start of the phase.
+        if self.phase == 'startup':
+            self._enter_phase('integration')
+        if self.simulated_time is None or simulated_time > self.simulated_time:
+            self.last_progress_time = time.perf_counter()
+        self.simulated_time = simulated_time
+        if self.phase == 'integration' and self.end_time is not None and simulated_time >= self.end_time:
+            self._enter_phase('shutdown')
+
+    def _sample_memory(self):
+        if self.process is not None and self.process.poll() is None:
+            peak = _peak_memory_kb(self.process.pid)
+            if peak is not None and (self.peak_memory_kb is None or peak > self.peak_memory_kb):
+                self.peak_memory_kb = peak
+
+    def terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self, stall_timeout=None, poll_interval=1.0):
+        """
+        Wait for the run to end, processing its output.
+        :param stall_timeout: If given, the process is terminated when the simulated time has not
+        advanced for this many seconds, and the record is marked as stalled.
+        :param poll_interval: The longest time in seconds between checks of the process.
+        :return: The metrics record of the run, see make_record.
+        """
+        stalled = False
+        while self.running:
+            self.poll(timeout=poll_interval)
+            if stall_timeout is not None and not stalled and self.seconds_since_progress() > stall_timeout:
+                stalled = True
+                self.terminate()
+        self.poll()
+        exit_code = self.process.wait()
+        if self.phase != 'shutdown':
+            # The run never reached endTime, so the time after the last report counts as shutdown.
+            if self.phase == 'integration':
+                self.phase_times['integration'] = self.phase_times.get('integration', 0.0) + \
+                    self.last_progress_time - self._phase_start
+                self.phase, self._phase_start = 'shutdown', self.last_progress_time
+            else:
+                self._enter_phase('shutdown')
+        self._enter_phase(None)
+        if self.peak_memory_kb is None:
+            self.peak_memory_kb = _children_peak_memory_kb()
+        self.record = self.make_record(exit_code, stalled)
+        if self.metrics_path is not None:
+            with open(self.metrics_path, 'a') as file:
+                file.write(json.dumps(self.record) + '\n')
+        return self.record
+
+    def make_record(self, exit_code, stalled=False):
+        driver = self.config.driver if self.config is not None else None
+        return {
+            'command': [str(arg) for arg in self.args] if not isinstance(self.args, str) else self.args,
+            'started': self.started.isoformat() if self.started is not None else None,
+            'exit code': exit_code,
+            'stalled': stalled,
+            'wall time': self.elapsed,
+            'phases': dict((phase, self.phase_times.get(phase, 0.0)) for phase in PHASES),
+            'simulated time': self.simulated_time,
+            'end time': self.end_time,
+            'dt_extern': self.dt_extern,
+            'steps': self.steps,
+            'expected steps': int(round(self.end_time / self.dt_extern)) if self.end_time and self.dt_extern else None,
+            'progress': self.progress,
+            'peak memory kb': self.peak_memory_kb,
+            'output lines': self.lines,
+            'uses_chem': driver.uses_chem if driver is not None else None,
+            'uses_diff': driver.uses_diff if driver is not None else None,
+            'uses_mafor': driver.uses_mafor if driver is not None else None,
+        }
+
+
+def run(args, config=None, stall_timeout=None, poll_interval=1.0, **kwargs):
+    """
+    Run an ESX executable to the end with a RunMonitor and return its metrics record. Keyword
+    arguments are given to RunMonitor.
+    """
+    monitor = RunMonitor(args, config=config, **kwargs)
+    monitor.start()
+    return monitor.wait(stall_timeout=stall_timeout, poll_interval=poll_interval)
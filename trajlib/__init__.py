@@ -1,13 +1,30 @@
 """
 This package provides various methods for integrating 3D trajectories.
+
+The submodules clustering, cross_section and output depend on numpy and netCDF4, which are slow to
+import, so they are imported when first accessed as attributes of the package.
 """
 
 
+import importlib
+
+from . import distributed
+from . import ensemble
 from . import methods
 from . import nilu
+from .ensemble import integrate_ensemble
 from .integrator import integrate, integrate_forever
 
 
+_LAZY_SUBMODULES = ('clustering', 'cross_section', 'output')
+
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+
+
 def straight_line(lat_lon, azimuth, distances):
     """
     Yields a sequence of tuples (latitude, longitude) representing a points
@@ -0,0 +1,201 @@
+"""
+This module provides clustering of trajectories into transport pathways.
+
+Trajectories, e.g. from NiluTrajectories or trajlib.integrate, are first resampled to a common
+number of steps into a dense numpy array of shape (trajectories, steps, 2) holding latitudes and
+longitudes. The distance between two trajectories is the mean great-circle distance between their
+corresponding points, computed on a sphere with the mean radius of the Earth. Distances are
+computed vectorized in chunks of trajectories, one step at a time, so that the temporary arrays
+hold one distance per pair of trajectories of a chunk and memory use stays bounded.
+
+The clustering functions return a tuple (labels, means), where labels holds the cluster index of
+each trajectory and means is an array of shape (clusters, steps, 2). Each mean is a sequence of
+(latitude, longitude) points which can be given directly as the latlons parameter of
+plotting.plot_projected_line.
+
+Example:
+
+    nilu = trajlib.nilu.NiluTrajectories('trajectories.txt')
+    resampled = trajlib.clustering.resample(trajlib.clustering.from_nilu(nilu.trajectories), 49)
+    labels, means = trajlib.clustering.kmeans(resampled, 6)
+    for mean in means:
+        plotting.plot_projected_line(latlons=mean)
+
+"""
+
+
+import numpy
+
+from .methods import EARTH_RADIUS
+
+
+def from_nilu(trajectories, lat_key='LAT', lon_key='LON'):
+    """
+    Return a list of (lats, lons) tuples from NILU trajectories.
+    :param trajectories: A sequence of NILU trajectory data dicts, or (date, time, data) tuples as
+    in the trajectories attribute of NiluTrajectories.
+    :param lat_key: The name of the latitude column.
+    :param lon_key: The name of the longitude column.
+    """
+    data_dicts = (item[2] if isinstance(item, tuple) else item for item in trajectories)
+    return [(data[lat_key], data[lon_key]) for data in data_dicts]
+
+
+def from_points(trajectories):
+    """
+    Return a list of (lats, lons) tuples from trajectories given as sequences of points, as yielded by
+    trajlib.integrate.
+    """
+    result = []
+    for points in trajectories:
+        points = list(points)
+        result.append(([point[0] for point in points], [point[1] for point in points]))
+    return result
+
+
+def resample(trajectories, steps):
+    """
+    Resample trajectories to a common number of steps, evenly spaced along each trajectory.
+    :param trajectories: A sequence of (lats, lons) tuples.
+    :param steps: The number of steps of the resampled trajectories.
+    :return: An array of shape (trajectories, steps, 2) of latitudes and longitudes.
+    """
+    result = numpy.empty((len(trajectories), steps, 2))
+    for idx, (lats, lons) in enumerate(trajectories):
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        # Unwrap the longitudes so that interpolation across the date line (or zero meridian) works.
+        lons = numpy.degrees(numpy.unwrap(numpy.radians(numpy.asarray(lons, dtype=numpy.float64))))
+        positions = numpy.linspace(0, len(lats) - 1, steps)
+        result[idx, :, 0] = numpy.interp(positions, numpy.arange(len(lats)), lats)
+        result[idx, :, 1] = numpy.interp(positions, numpy.arange(len(lons)), lons) % 360
+    return result
+
+
+def to_unit_vectors(resampled):
+    """
+    Convert an array of (latitude, longitude) pairs along the last axis to 3D unit vectors.
+    """
+    lats, lons = numpy.radians(resampled[..., 0]), numpy.radians(resampled[..., 1])
+    cos_lats = numpy.cos(lats)
+    return numpy.stack((cos_lats * numpy.cos(lons), cos_lats * numpy.sin(lons), numpy.sin(lats)), axis=-1)
+
+
+def from_unit_vectors(vectors):
+    """
+    Convert an array of 3D vectors along the last axis to (latitude, longitude) pairs. The vectors
+    need not be normalized.
+    """
+    x, y, z = vectors[..., 0], vectors[..., 1], vectors[..., 2]
+    lats = numpy.degrees(numpy.arctan2(z, numpy.hypot(x, y)))
+    lons = numpy.degrees(numpy.arctan2(y, x)) % 360
+    return numpy.stack((lats, lons), axis=-1)
+
+
+def _mean_distances(vectors_a, vectors_b):
+    # Mean great-circle distance in meters between all pairs of trajectories, as unit vectors. The
+    # angles are summed one step at a time, so that only arrays of shape (a, b) are allocated.
+    total = numpy.zeros((len(vectors_a), len(vectors_b)))
+    dots = numpy.empty_like(total)
+    for step in range(vectors_a.shape[1]):
+        numpy.dot(vectors_a[:, step], vectors_b[:, step].T, out=dots)
+        numpy.clip(dots, -1, 1, out=dots)
+        total += numpy.arccos(dots, out=dots)
+    return total * (EARTH_RADIUS / vectors_a.shape[1])
+
+
+def distances(resampled_a, resampled_b, chunk_size=256):
+    """
+    Compute the mean great-circle distances in meters between two sets of resampled trajectories.
+    :return: An array of shape (len(resampled_a), len(resampled_b)).
+    """
+    vectors_a, vectors_b = to_unit_vectors(resampled_a), to_unit_vectors(resampled_b)
+    return _chunked_distances(vectors_a, vectors_b, chunk_size)
+
+
+def _chunked_distances(vectors_a, vectors_b, chunk_size):
+    result = numpy.empty((len(vectors_a), len(vectors_b)))
+    for start in range(0, len(vectors_a), chunk_size):
+        result[start:start + chunk_size] = _mean_distances(vectors_a[start:start + chunk_size], vectors_b)
+    return result
+
+
+def _spherical_means(vectors, labels, count):
+    sums = numpy.zeros((count,) + vectors.shape[1:])
+    numpy.add.at(sums, labels, vectors)
+    norms = numpy.linalg.norm(sums, axis=-1, keepdims=True)
+    return sums / numpy.where(norms > 0, norms, 1)
+
+
+def cluster_means(resampled, labels, count=None):
+    """
+    Return the mean trajectory of each cluster, averaging corresponding points on the sphere.
+    :param resampled: An array of resampled trajectories.
+    :param labels: The cluster index of each trajectory.
+    :param count: The number of clusters. Defaults to the largest label plus one.
+    :return: An array of shape (clusters, steps, 2) of latitudes and longitudes.
+    """
+    labels = numpy.asarray(labels)
+    if count is None:
+        count = int(labels.max()) + 1
+    return from_unit_vectors(_spherical_means(to_unit_vectors(resampled), labels, count))
+
+
+def kmeans(resampled, k, max_iterations=100, seed=0, chunk_size=256):
+    """
+    Cluster trajectories using k-means on mean great-circle distances, with k-means++ seeding.
+    :param resampled: An array of resampled trajectories, see resample.
+    :param k: The number of clusters.
+    :param max_iterations: The maximum number of iterations.
+    :param seed: Random seed for the initial cluster centers.
+    :param chunk_size: The number of trajectories for which distances are computed at once.
+    :return: A tuple (labels, means).
+    """
+    if not 0 < k <= len(resampled):
+        raise ValueError('The number of clusters must be between one and the number of trajectories.')
+    rng = numpy.random.RandomState(seed)
+    vectors = to_unit_vectors(resampled)
+    # k-means++: pick centers with probability proportional to the squared distance to the closest center.
+    centers = vectors[[rng.randint(len(vectors))]]
+    closest = _chunked_distances(vectors, centers, chunk_size)[:, 0]
+    while len(centers) < k:
+        weights = closest ** 2
+        total = weights.sum()
+        pick = rng.choice(len(vectors), p=weights / total) if total > 0 else rng.randint(len(vectors))
+        centers = numpy.concatenate((centers, vectors[[pick]]))
+        closest = numpy.minimum(closest, _chunked_distances(vectors, vectors[[pick]], chunk_size)[:, 0])
+    labels = None
+    for _ in range(max_iterations):
+        center_distances = _chunked_distances(vectors, centers, chunk_size)
+        new_labels = center_distances.argmin(axis=1)
+        if labels is not None and numpy.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        centers = _spherical_means(vectors, labels, k)
+        # Reseed empty clusters with the trajectory farthest from its center.
+        for empty in numpy.setdiff1d(numpy.arange(k), labels):
+            farthest = center_distances[numpy.arange(len(labels)), labels].argmax()
+            centers[empty] = vectors[farthest]
+            labels[farthest] = empty
+            center_distances[farthest] = 0
+    return labels, from_unit_vectors(centers)
+
+
+def hierarchical(resampled, k, method='average', chunk_size=256):
+    """
+    Cluster trajectories using agglomerative hierarchical clustering on mean great-circle
+    distances. Requires scipy. Note that the full distance matrix is kept in memory.
+    :param resampled: An array of resampled trajectories, see resample.
+    :param k: The number of clusters.
+    :param method: The linkage method, see scipy.cluster.hierarchy.linkage. Defaults to average.
+    :param chunk_size: The number of trajectories for which distances are computed at once.
+    :return: A tuple (labels, means).
+    """
+    import scipy.cluster.hierarchy
+    import scipy.spatial.distance
+    vectors = to_unit_vectors(resampled)
+    matrix = _chunked_distances(vectors, vectors, chunk_size)
+    numpy.fill_diagonal(matrix, 0)
+    matrix = (matrix + matrix.T) / 2  # Remove round-off asymmetry.
+    linkage = scipy.cluster.hierarchy.linkage(scipy.spatial.distance.squareform(matrix), method=method)
+    labels = scipy.cluster.hierarchy.fcluster(linkage, k, criterion='maxclust') - 1
+    return labels, cluster_means(resampled, labels, int(labels.max()) + 1)
@@ -0,0 +1,148 @@
+"""
+This module provides extraction of vertical and horizontal cross sections of ECMWF variables.
+
+Paths are generated with array geodesic computations (pyproj.Geod.npts and Geod.fwd on arrays)
+rather than one point at a time as trajlib.straight_line does. The values of a cross section are
+looked up in one batch through Variable.get_values, using the bounds mode of the read planner, so
+a cross section at one time costs a single read per file rather than one read per point, level and
+interpolation corner. See ecmwf.planner.
+
+Missing values are returned as NaN.
+
+Example:
+
+    section = trajlib.cross_section.vertical_section(relative_humidity, (57.7, 11.9), (69.6, 18.9),
+                                                     100, time)
+    pyplot.pcolormesh(section.distances / 1000, section.levels, section.values.T)
+
+"""
+
+
+import collections
+
+import numpy
+
+from . import methods
+
+
+CrossSection = collections.namedtuple('CrossSection', ('values', 'latitudes', 'longitudes', 'distances', 'levels'))
+CrossSection.__doc__ = """
+A cross section of a variable. For vertical sections values has the shape (points, levels), and
+distances holds the distance in meters of each point along the path. For horizontal sections values
+has the shape (latitudes, longitudes) and distances is None. levels is None for variables without a
+level axis.
+"""
+
+
+def geodesic_path(start, end, count):
+    """
+    Return count points evenly spaced along the geodesic between two points, including both.
+    :param start: The start point (latitude, longitude).
+    :param end: The end point (latitude, longitude).
+    :param count: The number of points, at least two.
+    :return: A tuple (latitudes, longitudes, distances) of arrays, with longitudes in 0 to 360 and
+    the distances in meters from the start point.
+    """
+    if count < 2:
+        raise ValueError('A path needs at least two points.')
+    _, _, total = methods.GEOD.inv(start[1], start[0], end[1], end[0])
+    inner = numpy.array(methods.GEOD.npts(start[1], start[0], end[1], end[0], count - 2)).reshape(-1, 2)
+    lons = numpy.concatenate(([start[1]], inner[:, 0], [end[1]])) % 360
+    lats = numpy.concatenate(([start[0]], inner[:, 1], [end[0]]))
+    return lats, lons, numpy.linspace(0, total, count)
+
+
+def straight_line(lat_lon, azimuth, distances):
+    """
+    Return the points at the given distances along a geodesic from an origin, computed in one
+    array call.
+    :param lat_lon: Origin (latitude, longitude).
+    :param azimuth: The direction of travel, defined as degrees CW from north.
+    :param distances: A sequence of distances in meters from the origin.
+    :return: A tuple (latitudes, longitudes) of arrays, with longitudes in 0 to 360.
+    """
+    distances = numpy.asarray(distances, dtype=numpy.float64)
+    lons, lats, _ = methods.GEOD.fwd(numpy.full(distances.shape, lat_lon[1], dtype=numpy.float64),
+                                     numpy.full(distances.shape, lat_lon[0], dtype=numpy.float64),
+                                     numpy.full(distances.shape, azimuth, dtype=numpy.float64), distances)
+    return numpy.asarray(lats), numpy.asarray(lons) % 360
+
+
+def variable_levels(variable, time):
+    """
+    Return the sorted levels of a variable in the file covering the given time, or None if the
+    variable has no level axis.
+    """
+    if 'level' not in variable.type:
+        return None
+    level_axis = variable.type.index('level')
+    time_axis = variable.type.index('time') if 'time' in variable.type else None
+    for dataset, ranges in variable.dataset_ranges.items():
+        if time_axis is None or ranges[time_axis][0] <= time <= ranges[time_axis][1]:
+            return numpy.array(variable.dataset_indexing[dataset][level_axis][1])
+    raise RuntimeError('No data available for variable ' + variable.name + ' at time ' + str(time))
+
+
+def _sample(variable, time, lats, lons, levels):
+    # Looks up the values at all combinations of the (lat, lon) pairs and levels in one batch.
+    coordinates = {'time': time}
+    items = []
+    for lat, lon in zip(lats, lons):
+        coordinates['latitude'], coordinates['longitude'] = lat, lon
+        for level in (levels if levels is not None else (None,)):
+            coordinates['level'] = level
+            items.append(tuple(coordinates[axis] for axis in variable.type))
+    values = variable.get_values(items, mode='bounds')
+    values = numpy.array([numpy.nan if value is numpy.ma.masked else value for value in values], dtype=numpy.float64)
+    return values.reshape((len(lats),) + ((len(levels),) if levels is not None else ()))
+
+
+def curtain(variable, lats, lons, time, levels=None):
+    """
+    Sample a variable along a path at the given levels and time.
+    :param variable: An ecmwf.inventory.Variable, whose inventory is used as a context manager.
+    :param lats: The latitudes of the points of the path.
+    :param lons: The longitudes of the points of the path, in the range of the data (0 to 360).
+    :param time: The time, in the unit of the time axis of the variable.
+    :param levels: The levels to sample. Defaults to all levels of the variable at the time.
+    :return: An array of shape (points, levels), or (points,) for variables without levels.
+    """
+    if levels is None:
+        levels = variable_levels(variable, time)
+    return _sample(variable, time, lats, lons, levels)
+
+
+def vertical_section(variable, start, end, count, time, levels=None):
+    """
+    Extract a vertical cross section (curtain) of a variable along the geodesic between two points.
+    :param variable: An ecmwf.inventory.Variable, whose inventory is used as a context manager.
+    :param start: The start point (latitude, longitude).
+    :param end: The end point (latitude, longitude).
+    :param count: The number of points along the path.
+    :param time: The time, in the unit of the time axis of the variable.
+    :param levels: The levels to sample. Defaults to all levels of the variable at the time.
+    :return: A CrossSection.
+    """
+    lats, lons, distances = geodesic_path(start, end, count)
+    if levels is None:
+        levels = variable_levels(variable, time)
+    return CrossSection(curtain(variable, lats, lons, time, levels), lats, lons, distances, levels)
+
+
+def horizontal_section(variable, lats, lons, time, level=None):
+    """
+    Extract a horizontal cross section of a variable on a latitude/longitude grid.
+    :param variable: An ecmwf.inventory.Variable, whose inventory is used as a context manager.
+    :param lats: The latitudes of the grid.
+    :param lons: The longitudes of the grid, in the range of the data (0 to 360).
+    :param time: The time, in the unit of the time axis of the variable.
+    :param level: The level, required for variables with a level axis.
+    :return: A CrossSection with values of shape (latitudes, longitudes).
+    """
+    if 'level' in variable.type and level is None:
+        raise ValueError('A level must be given for variable ' + variable.name + ', which has a level axis.')
+    lats, lons = numpy.asarray(lats, dtype=numpy.float64), numpy.asarray(lons, dtype=numpy.float64)
+    grid_lats, grid_lons = numpy.meshgrid(lats, lons, indexing='ij')
+    levels = [level] if 'level' in variable.type else None
+    values = _sample(variable, time, grid_lats.ravel(), grid_lons.ravel(), levels)
+    return CrossSection(values.reshape(grid_lats.shape), lats, lons, None, levels)
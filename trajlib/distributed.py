@@ -0,0 +1,311 @@
+"""
+This module provides a file based work queue for distributing trajectory integration over several
+processes and machines sharing a file system.
+
+Start points are split into shards which are written to the pending directory of the queue.
+Workers claim shards by atomically renaming them into the claimed directory, integrate the
+trajectories of the shard with trajlib.integrate and write them to a netCDF4 file in the results
+directory (see trajlib.output). Finished shards are moved to the done directory, and shards whose
+integration raised an exception are moved to the failed directory together with the traceback.
+
+Workers touch a shard just before claiming it and keep touching their claim while working on it.
+Claims that have not been touched for a while, e.g. because the worker or its machine died, can be
+returned to the pending directory with WorkQueue.requeue_stale, which workers also do themselves if
+given a stale_timeout. A worker whose claim was requeued abandons the shard without reporting it,
+since the shard will be processed again.
+
+Example:
+
+    @contextlib.contextmanager
+    def era_winds():
+        inventory = ecmwf.inventory.Inventory()
+        inventory.add_directory('/shared/era')
+        u = inventory.construct_variable(*ecmwf.variables.U_VELOCITY)
+        ...
+        with inventory:
+            yield lambda point: (u[...], v[...], w[...])
+
+    queue = trajlib.distributed.WorkQueue('/shared/campaign')
+    queue.add_shards(start_points, shard_size=100)
+    # Then, on any number of machines:
+    trajlib.distributed.run_worker('/shared/campaign', era_winds, dt=-600, duration=5 * 24 * 3600)
+
+"""
+
+
+import collections
+import json
+import os
+import socket
+import time
+import traceback
+
+from .integrator import integrate
+from .methods import move_euler
+
+
+Claim = collections.namedtuple('Claim', ('shard', 'path', 'worker_id'))
+
+
+def default_worker_id():
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+def _write_atomically(path, text):
+    temporary_path = '%s.%s.tmp' % (path, default_worker_id())
+    with open(temporary_path, 'w') as file:
+        file.write(text)
+    os.replace(temporary_path, path)
+
+
+class WorkQueue:
+    """
+    A work queue of trajectory shards in a directory. See the module documentation.
+    """
+
+    SUBDIRECTORIES = ('pending', 'claimed', 'done', 'failed', 'results')
+
+    def __init__(self, directory):
+        self.directory = directory
+        for name in self.SUBDIRECTORIES:
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def _path(self, subdirectory, name=''):
+        return os.path.join(self.directory, subdirectory, name)
+
+    def add_shards(self, start_points, shard_size):
+        """
+        Split start points into shards and add them to the queue.
+        :param start_points: A sequence of start points, as given to trajlib.integrate.
+        :param shard_size: The number of start points per shard.
+        :return: A list of the names of the added shards.
+        """
+        start_points = [list(point) for point in start_points]
+        existing = [int(name[len('shard-'):name.index('.json')])
+                    for subdirectory in ('pending', 'claimed', 'done', 'failed')
+                    for name in os.listdir(self._path(subdirectory))
+                    if name.startswith('shard-') and '.json' in name]
+        next_index = max(existing) + 1 if existing else 0
+        shards = []
+        for first in range(0, len(start_points), shard_size):
+            shard = 'shard-%08d' % (next_index + len(shards))
+            content = {'first_particle': first, 'start_points': start_points[first:first + shard_size]}
+            _write_atomically(self._path('pending', shard + '.json'), json.dumps(content))
+            shards.append(shard)
+        return shards
+
+    def claim(self, worker_id=None):
+        """
+        Claim a pending shard.
+        :param worker_id: The id of the claiming worker. Defaults to the host name and process id.
+        :return: A Claim, or None if there are no pending shards.
+        """
+        worker_id = worker_id or default_worker_id()
+        for name in sorted(os.listdir(self._path('pending'))):
+            if not name.endswith('.json'):
+                continue
+            pending_path = self._path('pending', name)
+            claimed_path = self._path('claimed', name + '.' + worker_id)
+            try:
+                # Touch the shard before renaming it, since the rename keeps the modification time,
+                # so that the claim is never seen as stale by requeue_stale.
+                os.utime(pending_path)
+                os.rename(pending_path, claimed_path)
+            except FileNotFoundError:
+                continue  # Claimed by another worker first.
+            return Claim(name[:-len('.json')], claimed_path, worker_id)
+        return None
+
+    def load(self, claim):
+        """
+        Return the content of a claimed shard as a dict with the keys first_particle and start_points.
+        """
+        with open(claim.path, 'r') as file:
+            return json.load(file)
+
+    def heartbeat(self, claim):
+        """
+        Mark a claim as still being worked on. Returns false if the claim was lost, e.g. requeued
+        as stale.
+        """
+        try:
+            os.utime(claim.path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def result_path(self, shard):
+        return self._path('results', shard + '.nc')
+
+    def complete(self, claim):
+        """
+        Mark a claimed shard as done. Returns false if the claim was lost, e.g. requeued as stale.
+        """
+        return self._move_claim(claim, 'done')
+
+    def fail(self, claim, message):
+        """
+        Mark a claimed shard as failed, storing the given message (e.g. a traceback) next to it.
+        Returns false if the claim was lost, e.g. requeued as stale, in which case no message is
+        stored.
+        """
+        if not self._move_claim(claim, 'failed'):
+            return False
+        _write_atomically(self._path('failed', claim.shard + '.error'), message)
+        return True
+
+    def _move_claim(self, claim, subdirectory):
+        try:
+            os.rename(claim.path, self._path(subdirectory, claim.shard + '.json'))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def requeue_stale(self, timeout):
+        """
+        Return claims that have not been touched for timeout seconds to the pending directory.
+        :return: A list of the names of the requeued shards.
+        """
+        requeued = []
+        now = time.time()
+        for name in os.listdir(self._path('claimed')):
+            path = self._path('claimed', name)
+            try:
+                if now - os.path.getmtime(path) < timeout:
+                    continue
+                shard = name[:name.index('.json.')]
+                os.rename(path, self._path('pending', shard + '.json'))
+            except (FileNotFoundError, ValueError):
+                continue
+            requeued.append(shard)
+        return requeued
+
+    def requeue_failed(self):
+        """
+        Return all failed shards to the pending directory, removing their error messages.
+        :return: A list of the names of the requeued shards.
+        """
+        requeued = []
+        for name in os.listdir(self._path('failed')):
+            if name.endswith('.json'):
+                try:
+                    os.rename(self._path('failed', name), self._path('pending', name))
+                except FileNotFoundError:
+                    continue
+                error_path = self._path('failed', name[:-len('.json')] + '.error')
+                if os.path.exists(error_path):
+                    os.remove(error_path)
+                requeued.append(name[:-len('.json')])
+        return requeued
+
+    def status(self):
+        """
+        Return a dict with the number of shards in each state: pending, claimed, done and failed.
+        """
+        return dict((name, sum(1 for entry in os.listdir(self._path(name)) if '.json' in entry))
+                    for name in ('pending', 'claimed', 'done', 'failed'))
+
+    def errors(self):
+        """
+        Return a dict mapping the names of failed shards to their error messages.
+        """
+        errors = {}
+        for name in os.listdir(self._path('failed')):
+            if name.endswith('.error'):
+                with open(self._path('failed', name), 'r') as file:
+                    errors[name[:-len('.error')]] = file.read()
+        return errors
+
+    def results(self):
+        """
+        Return a sorted list of the paths of the result files of done shards.
+        """
+        done = sorted(name[:-len('.json')] for name in os.listdir(self._path('done')) if name.endswith('.json'))
+        return [self.result_path(shard) for shard in done]
+
+
+def run_worker(queue, uvw_factory, dt, duration, method=move_euler, extra_columns=(), worker_id=None,
+               stale_timeout=None):
+    """
+    Process shards from a work queue until no pending shards remain.
+
+    :param queue: A WorkQueue, or the directory of one.
+    :param uvw_factory: A function called once per worker, returning either a context manager
+    yielding the uvw function, or the uvw function itself. E.g. a contextlib.contextmanager which
+    sets up an inventory and yields a function reading from it.
+    :param dt: The time step, as for trajlib.integrate.
+    :param duration: The duration, as for trajlib.integrate.
+    :param method: The integration method, as for trajlib.integrate.
+    :param extra_columns: Names of extra columns taken from point[4:], see trajlib.output.
+    :param worker_id: The id of the worker. Defaults to the host name and process id.
+    :param stale_timeout: If given, claims untouched for this many seconds are requeued before
+    each claim.
+    :return: A tuple (done, failed) with the number of shards processed. Shards whose claim was
+    lost are not counted.
+    """
+    from .output import TrajectoryWriter
+    if not isinstance(queue, WorkQueue):
+        queue = WorkQueue(queue)
+    worker_id = worker_id or default_worker_id()
+    done, failed = 0, 0
+    uvw = uvw_factory()
+    context = uvw if hasattr(uvw, '__enter__') else None
+    uvw_func = context.__enter__() if context is not None else uvw
+    try:
+        while True:
+            if stale_timeout is not None:
+                queue.requeue_stale(stale_timeout)
+            claim = queue.claim(worker_id)
+            if claim is None:
+                break
+            temporary_path = '%s.%s.tmp' % (queue.result_path(claim.shard), worker_id)
+            try:
+                shard = queue.load(claim)
+                start_points = shard['start_points']
+                attributes = {'first_particle': shard['first_particle'], 'dt': dt, 'duration': duration}
+                lost = False
+                with TrajectoryWriter(temporary_path, len(start_points), extra_columns=extra_columns,
+                                      attributes=attributes) as writer:
+                    for particle, start_point in enumerate(start_points):
+                        writer.write_trajectory(particle, integrate(tuple(start_point), uvw_func, dt, duration,
+                                                                    method=method))
+                        if not queue.heartbeat(claim):
+                            lost = True
+                            break
+                if lost:
+                    os.remove(temporary_path)
+                    continue
+                os.replace(temporary_path, queue.result_path(claim.shard))
+                if queue.complete(claim):
+                    done += 1
+            except Exception:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+                if queue.fail(claim, traceback.format_exc()):
+                    failed += 1
+    finally:
+        if context is not None:
+            context.__exit__(None, None, None)
+    return done, failed
+
+
+def run_local(queue, worker_count, uvw_factory, dt, duration, **kwargs):
+    """
+    Run run_worker in several local processes and wait for them to finish. Useful for testing a
+    queue, or for using all cores of a single machine. The arguments must be picklable, e.g.
+    uvw_factory should be a module level function.
+
+    :param queue: The directory of a WorkQueue.
+    :param worker_count: The number of worker processes.
+    :return: A list of the exit codes of the processes.
+    """
+    import multiprocessing
+    directory = queue.directory if isinstance(queue, WorkQueue) else queue
+    processes = [multiprocessing.Process(target=run_worker, args=(directory, uvw_factory, dt, duration),
+                                         kwargs=kwargs)
+                 for _ in range(worker_count)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
@@ -0,0 +1,112 @@
+"""
+This module provides integration of ensembles of trajectories, advancing all particles in
+lock-step so that data files are read in time order, once per run.
+
+When the velocities come from ECMWF data through an ecmwf.inventory.Inventory, integrating
+particles one at a time makes the inventory open files all over the time range of the run, and
+with data spanning months they can not all be kept in memory. By instead advancing all particles
+together, the integration moves through time windows aligned to the time ranges of the files in the
+catalogue of the inventory. Files are opened when first used within a window and closed once every
+particle has left their time range.
+
+Particles leaving the domain (see methods.left_domain), e.g. when the velocities are looked up
+from variables returning NaN outside their coverage, are frozen at their last point inside the
+domain while the others continue.
+"""
+
+
+from .integrator import _counting_uvw_func
+from .methods import left_domain, move_euler
+
+
+class _WindowReleaser:
+    """
+    Closes the datasets of an inventory whose time ranges lie behind all particles.
+    """
+
+    def __init__(self, inventory, forward, time_transform):
+        self.inventory = inventory
+        self.forward = forward
+        self.time_transform = time_transform
+        # Time ranges in the order they are passed by the integration.
+        time_ranges = inventory.get_time_ranges()
+        self.pending = sorted(time_ranges.items(), key=lambda item: item[0][1] if forward else -item[0][0])
+        self.released = 0
+
+    def update(self, points):
+        times = [self.time_transform(point[3]) for point in points]
+        if self.forward:
+            frontier = min(times)
+            while self.released < len(self.pending) and self.pending[self.released][0][1] < frontier:
+                self._release(self.pending[self.released][1])
+        else:
+            frontier = max(times)
+            while self.released < len(self.pending) and self.pending[self.released][0][0] > frontier:
+                self._release(self.pending[self.released][1])
+
+    def _release(self, paths):
+        if self.inventory.open_datasets is not None:
+            for path in paths:
+                self.inventory.close_dataset(path)
+        self.released += 1
+
+
+def _identity(value):
+    return value
+
+
+def integrate_ensemble(start_points, uvw_func, dt, duration, method=move_euler, inventory=None,
+                       time_transform=None, metrics=None):
+    """
+    Yields tuples with the points of all particles for each step of the integration, starting with
+    the start points. All particles are advanced together, one step at a time.
+
+    A particle which leaves the domain is frozen: it keeps its last point inside the domain, so its
+    time stops advancing, and it is no longer moved. The integration ends early if all particles
+    are frozen.
+
+    If an inventory is given, the datasets of files whose time range (from the catalogue of the
+    inventory) lies entirely behind every particle are closed, so that only the files covering the
+    current time window are kept open. The inventory must be used as a context manager around the
+    integration.
+
+    :param start_points: A sequence of starting points, one per particle.
+    :param uvw_func: Function returning a 3-tuple of velocities when given a point.
+    :param dt: The time step.
+    :param duration: The duration for which to integrate.
+    :param method: The integration method. Default to Euler.
+    :param inventory: An optional ecmwf.inventory.Inventory from which uvw_func reads data.
+    :param time_transform: Function converting the time of a point to the time unit of the
+    catalogue (hours for ECMWF files). Defaults to using the time as is.
+    :param metrics: An optional ecmwf.metrics.Metrics object counting steps and uvw evaluations.
+    """
+    if time_transform is None:
+        time_transform = _identity
+    if metrics is not None:
+        uvw_func = _counting_uvw_func(uvw_func, metrics)
+
+    releaser = _WindowReleaser(inventory, dt > 0, time_transform) if inventory is not None else None
+    points = tuple(start_points)
+    active = [not left_domain(point) for point in points]
+    yield points
+    for step in range(int(duration // abs(dt))):
+        moved = sum(active)
+        if moved == 0:
+            return
+        new_points = []
+        for idx, point in enumerate(points):
+            if active[idx]:
+                new_point = method(point, uvw_func, dt)
+                if left_domain(new_point):
+                    active[idx] = False
+                    if metrics is not None:
+                        metrics.count('particles frozen')
+                else:
+                    point = new_point
+            new_points.append(point)
+        points = tuple(new_points)
+        if metrics is not None:
+            metrics.count('integration steps', moved)
+        if releaser is not None and any(active):
+            releaser.update([point for point, is_active in zip(points, active) if is_active])
+        yield points
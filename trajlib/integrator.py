@@ -5,39 +5,61 @@ returning 3D velocities when given a point, a time step and optionally an
 integration method.
 
 See the methods module in this package.
+
+Integration of a trajectory ends early when it leaves the domain (see methods.left_domain), e.g.
+when the velocities are looked up from variables returning NaN outside their coverage.
 """
 
 
-from .methods import move_euler
+import itertools
+
+from .methods import left_domain, move_euler
+
+
+def _counting_uvw_func(uvw_func, metrics):
+
+    def counting(point):
+        metrics.count('uvw evaluations')
+        return uvw_func(point)
+
+    return counting
 
 
-def integrate_forever(start_point, uvw_func, dt, method=move_euler):
+def integrate_forever(start_point, uvw_func, dt, method=move_euler, metrics=None):
     """
-    Yields integrated points forever.
+    Yields integrated points forever, or until the trajectory leaves the domain.
     :param start_point: Starting point of integration. Yielded first.
     :param uvw_func: Function returning a 3-tuple of velocities when given a point.
     :param dt: The time step.
     :param method: The integration method. Default to Euler.
+    :param metrics: An optional ecmwf.metrics.Metrics object counting steps and uvw evaluations.
     """
+    if metrics is not None:
+        uvw_func = _counting_uvw_func(uvw_func, metrics)
     point = start_point
     yield point
     while True:
         point = method(point, uvw_func, dt)
+        if metrics is not None:
+            metrics.count('integration steps')
+        if left_domain(point):
+            if metrics is not None:
+                metrics.count('particles frozen')
+            return
         yield point
 
 
-def integrate(start_point, uvw_func, dt, duration, method=move_euler):
+def integrate(start_point, uvw_func, dt, duration, method=move_euler, metrics=None):
     """
-    Yields integrated points for the specified duration.
+    Yields integrated points for the specified duration, or until the trajectory leaves the domain.
     :param start_point: Starting point of integration. Yielded first.
     :param uvw_func: Function returning a 3-tuple of velocities when given a point.
     :param dt: The time step.
     :param duration: The duration for which to integrate.
     :param method: The integration method. Default to Euler.
+    :param metrics: An optional ecmwf.metrics.Metrics object counting steps and uvw evaluations.
     """
     steps = int(duration // abs(dt))
-    integration = integrate_forever(start_point, uvw_func, dt, method=method)
-    yield next(integration)
-    for step in range(steps):
-        yield next(integration)
+    integration = integrate_forever(start_point, uvw_func, dt, method=method, metrics=metrics)
+    yield from itertools.islice(integration, steps + 1)
     integration.close()
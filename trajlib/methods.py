@@ -7,56 +7,166 @@ longitude in degrees, while z and time are unit agnostic. Additional values may
 Velocities are represented as tuples with (u, v, w) where u and v are the eastward and northward velocities in units
 of meters per time unit. The last value, w, is expected to match whatever unit z positions are given in, per time unit.
 
-Horizontal movement is done on the WGS84 reference ellipsoid.
+Horizontal movement is done by a movement kernel, by default move which moves exactly on the WGS84 reference
+ellipsoid. move_spherical instead moves along a great circle on a sphere with the mean radius of the Earth. Compared
+to move its position error is below 0.6 % of the distance moved in each step, e.g. below 650 m for a step of 30 m/s
+for one hour, which is well below the resolution of the ECMWF grids. The kernel used by the integration methods is
+selected with their kernel parameter, e.g. functools.partial(move_rk4, kernel=move_spherical).
+
+For single points move_spherical is hardly faster than move, since the call overhead dominates both: in the
+benchmarks it was about 10-20 % faster on random inputs and up to about 10 % slower at a fixed point. Where speed
+matters, move many points at once with the numpy vectorized versions of the kernels, move_arrays and
+move_spherical_arrays, of which move_spherical_arrays is the fast one, about 4-6 times faster than move_arrays.
+
+Velocities of NaN, e.g. from an ecmwf.inventory.Variable returning NaN outside the coverage of the data, move a point
+out of the domain: its latitude, longitude and z become NaN. See left_domain.
+
+Importing pyproj is slow, so the pyproj.Geod object GEOD is created when first accessed as an attribute of the
+module (or imported from it), through a module level __getattr__.
 """
 
 import math
-import pyproj
 
 
-GEOD = pyproj.Geod(ellps='WGS84')
+def _geod():
+    # Returns GEOD, creating it on first use.
+    geod = globals().get('GEOD')
+    if geod is None:
+        import pyproj
+        geod = globals()['GEOD'] = pyproj.Geod(ellps='WGS84')
+    return geod
+
+
+def __getattr__(name):
+    if name == 'GEOD':
+        return _geod()
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+
+EARTH_RADIUS = 6371008.8  # Mean radius of the WGS84 ellipsoid in meters.
+
+
+def left_domain(point):
+    """
+    Return true if the point has left the domain, i.e. has a NaN latitude, longitude or z.
+    """
+    lat, lon, z = point[0:3]
+    return lat != lat or lon != lon or z != z
+
+
+def _outside(point, dt):
+    return (math.nan, math.nan, math.nan, point[3] + dt) + point[4:]
 
 
 def move(point, uvw, dt):
     lat, lon, z, t = point[0:4]
     u, v, w = uvw
+    if u != u or v != v or w != w:
+        return _outside(point, dt)
     azimuth = math.degrees(math.atan2(u, v))
     distance = math.sqrt(u*u + v*v) * dt
-    new_lon, new_lat, _ = GEOD.fwd(lon, lat, azimuth, distance)
+    new_lon, new_lat, _ = _geod().fwd(lon, lat, azimuth, distance)
     new_lon %= 360  # Keep longitude in 0 to 360 range.
     new_lat = (new_lat + 90) % 180 - 90  # Keep latitude in -90 to 90 range.
     return (new_lat, new_lon, z + w * dt, t + dt) + point[4:]
 
 
-def move_euler(point, uvw_func, dt):
+def move_spherical(point, uvw, dt):
+    """
+    Fast approximation of move, moving along a great circle on a sphere with the mean radius of the Earth.
+    """
+    lat, lon, z, t = point[0:4]
+    u, v, w = uvw
+    if u != u or v != v or w != w:
+        return _outside(point, dt)
+    speed = math.sqrt(u*u + v*v)
+    if speed == 0:
+        return (lat, lon % 360, z + w * dt, t + dt) + point[4:]
+    angle = speed * dt / EARTH_RADIUS
+    sin_angle, cos_angle = math.sin(angle), math.cos(angle)
+    lat_rad = math.radians(lat)
+    sin_lat, cos_lat = math.sin(lat_rad), math.cos(lat_rad)
+    new_sin_lat = min(1.0, max(-1.0, sin_lat * cos_angle + cos_lat * sin_angle * v / speed))
+    new_lat = math.degrees(math.asin(new_sin_lat))
+    new_lon = lon + math.degrees(math.atan2(sin_angle * cos_lat * u / speed, cos_angle - sin_lat * new_sin_lat))
+    return (new_lat, new_lon % 360, z + w * dt, t + dt) + point[4:]
+
+
+def _outside_arrays(u, v, w, lats, lons, zs):
+    # Sets the positions moved by NaN velocities to NaN, as _outside does for single points.
+    import numpy
+    outside = numpy.isnan(u) | numpy.isnan(v) | numpy.isnan(w)
+    if not outside.any():
+        return lats, lons, zs
+    return tuple(numpy.where(outside, numpy.nan, values) for values in (lats, lons, zs))
+
+
+def move_arrays(lats, lons, zs, ts, u, v, w, dt):
+    """
+    Vectorized version of move, moving many points at once on the WGS84 reference ellipsoid.
+    :return: A tuple of arrays (lats, lons, zs, ts) with the new positions.
+    """
+    import numpy
+    lats, lons, u, v, w = (numpy.asarray(a, dtype=numpy.float64) for a in (lats, lons, u, v, w))
+    azimuth = numpy.degrees(numpy.arctan2(u, v))
+    distance = numpy.sqrt(u*u + v*v) * dt
+    new_lons, new_lats, _ = _geod().fwd(*numpy.broadcast_arrays(lons, lats, azimuth, distance))
+    new_lons = numpy.asarray(new_lons) % 360
+    new_lats = (numpy.asarray(new_lats) + 90) % 180 - 90
+    new_lats, new_lons, new_zs = _outside_arrays(u, v, w, new_lats, new_lons, numpy.asarray(zs) + w * dt)
+    return new_lats, new_lons, new_zs, numpy.asarray(ts) + dt
+
+
+def move_spherical_arrays(lats, lons, zs, ts, u, v, w, dt):
+    """
+    Vectorized version of move_spherical, moving many points at once along great circles.
+    :return: A tuple of arrays (lats, lons, zs, ts) with the new positions.
+    """
+    import numpy
+    lats, lons, u, v, w = (numpy.asarray(a, dtype=numpy.float64) for a in (lats, lons, u, v, w))
+    speed = numpy.sqrt(u*u + v*v)
+    angle = speed * dt / EARTH_RADIUS
+    sin_angle, cos_angle = numpy.sin(angle), numpy.cos(angle)
+    lat_rad = numpy.radians(lats)
+    sin_lat, cos_lat = numpy.sin(lat_rad), numpy.cos(lat_rad)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        sin_azimuth = numpy.where(speed > 0, u / speed, 0)
+        cos_azimuth = numpy.where(speed > 0, v / speed, 0)
+    new_sin_lat = numpy.clip(sin_lat * cos_angle + cos_lat * sin_angle * cos_azimuth, -1, 1)
+    new_lats = numpy.degrees(numpy.arcsin(new_sin_lat))
+    new_lons = lons + numpy.degrees(numpy.arctan2(sin_angle * cos_lat * sin_azimuth, cos_angle - sin_lat * new_sin_lat))
+    new_lats, new_lons, new_zs = _outside_arrays(u, v, w, new_lats, new_lons % 360, numpy.asarray(zs) + w * dt)
+    return new_lats, new_lons, new_zs, numpy.asarray(ts) + dt
+
+
+def move_euler(point, uvw_func, dt, kernel=move):
     """
     Euler method of integration.
     """
-    return move(point, uvw_func(point), dt)
+    return kernel(point, uvw_func(point), dt)
 
 
-def move_trapezoid(point, uvw_func, dt):
+def move_trapezoid(point, uvw_func, dt, kernel=move):
     """
     Trapezoid method of integration.
     """
     uvw_1 = uvw_func(point)
-    first_step = move(point, uvw_1, dt)
+    first_step = kernel(point, uvw_1, dt)
     uvw_2 = uvw_func(first_step)
     uvw = ((uvw_1[0] + uvw_2[0]) / 2,
            (uvw_1[1] + uvw_2[1]) / 2,
            (uvw_1[2] + uvw_2[2]) / 2)
-    return move(point, uvw, dt)
+    return kernel(point, uvw, dt)
 
 
-def move_rk4(point, uvw_func, dt):
+def move_rk4(point, uvw_func, dt, kernel=move):
     """
     Runge-Kutta fourth degree method of integration (RK4).
     """
     uvw_1 = uvw_func(point)
-    uvw_2 = uvw_func(move(point, uvw_1, dt / 2))
-    uvw_3 = uvw_func(move(point, uvw_2, dt / 2))
-    uvw_4 = uvw_func(move(point, uvw_3, dt))
+    uvw_2 = uvw_func(kernel(point, uvw_1, dt / 2))
+    uvw_3 = uvw_func(kernel(point, uvw_2, dt / 2))
+    uvw_4 = uvw_func(kernel(point, uvw_3, dt))
     uvw = ((uvw_1[0] + uvw_2[0] * 2 + uvw_3[0] * 2 + uvw_4[0]) / 6,
            (uvw_1[1] + uvw_2[1] * 2 + uvw_3[1] * 2 + uvw_4[1]) / 6,
            (uvw_1[2] + uvw_2[2] * 2 + uvw_3[2] * 2 + uvw_4[2]) / 6)
-    return move(point, uvw, dt)
+    return kernel(point, uvw, dt)
@@ -0,0 +1,152 @@
+"""
+This module provides a TrajectoryWriter class for writing integrated trajectories to netCDF4 files.
+
+Points are consumed incrementally and buffered into fixed-size blocks before being written, so
+memory use is bounded by the block size regardless of how long the integration runs. Steps of all
+particles written with write_step are buffered in blocks limited to STEP_BUFFER_BYTES, so that
+memory also stays bounded for large ensembles.
+
+The output file has the dimensions (particle, step) with one variable per column: latitude,
+longitude, z and time, followed by any extra columns taken from point[4:]. Steps that have not been
+written are filled with NaN.
+"""
+
+
+import netCDF4
+import numpy
+
+
+class TrajectoryWriter:
+    """
+    Writes trajectories to a chunked, compressed netCDF4 file.
+
+    Trajectories may be written one particle at a time with write_trajectory, e.g. directly from
+    trajlib.integrate, or one step for all particles at a time with write_step.
+
+    Example:
+
+        with trajlib.output.TrajectoryWriter('out.nc', len(start_points)) as writer:
+            for particle, start_point in enumerate(start_points):
+                writer.write_trajectory(particle, trajlib.integrate(start_point, uvw_func, dt, duration))
+
+    """
+
+    COLUMNS = ('latitude', 'longitude', 'z', 'time')
+    # The default size in bytes of the buffer of steps written with write_step.
+    STEP_BUFFER_BYTES = 64 * 2 ** 20
+
+    def __init__(self, path, particle_count, extra_columns=(), block_size=1024, chunk_shape=None,
+                 compression_level=4, dtype='f8', attributes=None, step_block_size=None):
+        """
+        :param path: The path of the netCDF4 file to create.
+        :param particle_count: The number of particles (trajectories) in the file.
+        :param extra_columns: Names of extra columns, taken in order from point[4:].
+        :param block_size: The number of steps buffered before data is written to the file.
+        :param chunk_shape: The (particle, step) chunk shape of the variables. Defaults to at most
+        16 particles by at most 512 steps.
+        :param compression_level: The zlib compression level, 1 to 9, or 0 to disable compression.
+        :param dtype: The netCDF data type used for all columns. Defaults to double precision.
+        :param attributes: An optional dict of global attributes to store in the file.
+        :param step_block_size: The number of steps written with write_step buffered before data is
+        written to the file. Defaults to as many as fit in STEP_BUFFER_BYTES, at least one and at
+        most block_size.
+        """
+        self.path = path
+        self.particle_count = particle_count
+        self.columns = self.COLUMNS + tuple(extra_columns)
+        self.block_size = block_size
+        if step_block_size is None:
+            step_bytes = max(particle_count, 1) * len(self.columns) * 8
+            step_block_size = max(1, min(block_size, self.STEP_BUFFER_BYTES // step_bytes))
+        self.step_block_size = step_block_size
+        self.step_count = 0
+        if chunk_shape is None:
+            chunk_shape = (min(particle_count, 16), min(block_size, 512))
+        self.dataset = netCDF4.Dataset(path, 'w')
+        self.dataset.createDimension('particle', particle_count)
+        self.dataset.createDimension('step', None)
+        for key, value in (attributes or {}).items():
+            self.dataset.setncattr(key, value)
+        self.variables = [self.dataset.createVariable(column, dtype, ('particle', 'step'),
+                                                      zlib=compression_level > 0, complevel=compression_level or 1,
+                                                      shuffle=True, chunksizes=chunk_shape, fill_value=numpy.nan)
+                          for column in self.columns]
+        self._step_buffer = None
+        self._step_buffer_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _fill_row(self, row, point):
+        values = point[:len(self.columns)]
+        row[:len(values)] = values
+        row[len(values):] = numpy.nan
+
+    def write_trajectory(self, particle, points, first_step=0):
+        """
+        Write the points of a single trajectory, consuming them incrementally.
+        :param particle: The index of the particle.
+        :param points: An iterable of points, e.g. a trajlib.integrate generator.
+        :param first_step: The step index of the first point. Defaults to zero.
+        :return: The number of points written.
+        """
+        buffer = numpy.empty((self.block_size, len(self.columns)))
+        count, step = 0, first_step
+        for point in points:
+            self._fill_row(buffer[count], point)
+            count += 1
+            if count == self.block_size:
+                self._write_block(particle, step, buffer, count)
+                step += count
+                count = 0
+        if count > 0:
+            self._write_block(particle, step, buffer, count)
+            step += count
+        self.step_count = max(self.step_count, step)
+        return step - first_step
+
+    def _write_block(self, particle, step, buffer, count):
+        for idx, variable in enumerate(self.variables):
+            variable[particle, step:step + count] = buffer[:count, idx]
+
+    def write_step(self, points):
+        """
+        Write one step for all particles, e.g. as yielded by a lock-step ensemble integration.
+        :param points: A sequence of one point per particle.
+        :return: The index of the written step.
+        """
+        if len(points) != self.particle_count:
+            raise ValueError('Expected %d points, got %d.' % (self.particle_count, len(points)))
+        if self._step_buffer is None:
+            self._step_buffer = numpy.empty((self.step_block_size, self.particle_count, len(self.columns)))
+        rows = self._step_buffer[self._step_buffer_count]
+        for row, point in zip(rows, points):
+            self._fill_row(row, point)
+        self._step_buffer_count += 1
+        if self._step_buffer_count == self.step_block_size:
+            self.flush()
+        return self.step_count + self._step_buffer_count - 1
+
+    def flush(self):
+        """
+        Write any buffered steps written with write_step to the file.
+        """
+        count = self._step_buffer_count
+        if count == 0:
+            return
+        step = self.step_count
+        for idx, variable in enumerate(self.variables):
+            variable[:, step:step + count] = self._step_buffer[:count, :, idx].T
+        self.step_count += count
+        self._step_buffer_count = 0
+        self.dataset.sync()
+
+    def close(self):
+        if self.dataset is None:
+            return
+        self.flush()
+        self.dataset.close()
+        self.dataset = None